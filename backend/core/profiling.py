@@ -0,0 +1,158 @@
+"""
+On-demand request profiling
+
+ProfilingMiddleware profiles a request when either:
+- a staff user sends the PROFILING_HEADER header with a true value (X-Profile: 1,
+  "true", "yes" or "on"), authenticated by the session (admin) or by a JWT
+  Authorization header (API), or
+- it is picked by PROFILING_SAMPLE_RATE (0.0 - 1.0, off by default)
+
+For each profiled request two files are written to PROFILING_DIR:
+- <name>.collapsed - sampled call stacks in the folded format ("a;b;c count")
+  read by speedscope (https://www.speedscope.app) and flamegraph.pl
+- <name>.queries.json - every SQL query with its duration
+
+The file name is returned in the X-Profile-Id response header. Requests that are
+not profiled only pay for a header lookup (and a random() call when sampling).
+
+For a StreamingHttpResponse (e.g. the invoice change stream) the profile only
+covers building the response, not sending its content.
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+
+
+class StackSampler:
+    """
+    Samples the call stack of one thread at a fixed interval from a background thread
+    Stacks are counted in the folded format used by flamegraph tools
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class QueryRecorder:
+    """Database execute wrapper recording every query and its duration"""
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'PROFILING_HEADER', 'HTTP_X_PROFILE')
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.interval = getattr(settings, 'PROFILING_INTERVAL', 0.001)
+        self.directory = Path(getattr(settings, 'PROFILING_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+    def __call__(self, request):
+        if request.META.get(self.header, '').strip().lower() in TRUE_VALUES:
+            if not self.is_staff(request):
+                return self.get_response(request)
+        elif not (self.sample_rate and random.random() < self.sample_rate):
+            return self.get_response(request)
+
+        return self.profile(request)
+
+    def is_staff(self, request):
+        """Staff check using the session user, or the JWT Authorization header for API requests"""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except (InvalidToken, AuthenticationFailed):
+            return False
+        return result is not None and result[0].is_staff
+
+    def profile(self, request):
+        recorder = QueryRecorder()
+        sampler = StackSampler(threading.get_ident(), self.interval)
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            started = time.perf_counter()
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+                elapsed = time.perf_counter() - started
+
+        name = self.profile_name(request)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        sampler.write_collapsed(self.directory / f'{name}.collapsed')
+        with open(self.directory / f'{name}.queries.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 3),
+                'query_count': len(recorder.queries),
+                'query_time_ms': round(sum(q['duration_ms'] for q in recorder.queries), 3),
+                'queries': recorder.queries,
+            }, f, indent=2)
+
+        response['X-Profile-Id'] = name
+        return response
+
+    def profile_name(self, request):
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-')[:60] or 'root'
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{slug}-{uuid.uuid4().hex[:8]}"
@@ -54,6 +54,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,6 +91,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Holds the invoice report periods. Use a shared backend (e.g. Redis) when running
+# several server processes so invalidation on invoice writes reaches all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'invoice-project',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -135,8 +152,28 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_THROTTLE_RATES': {
+        # Token buckets per user: bursts of N requests, refilled at N per period
+        'tracking_start': '120/min',
+        'tracking_end': '120/min',
+    },
 }
 
+# Tracking settings
+TRACKING_DEDUP_CACHE_SIZE = 10000  # Number of recent beacon event ids kept in memory for duplicate detection
+TRACKING_DEDUP_RETENTION_DAYS = 7  # Days beacon receipts are kept (manage.py prune_beacon_receipts), older ids can be replayed
+TRACKING_OPEN_EVENT_CACHE_SIZE = 10000  # Number of open page events kept in memory so event_end can close them by primary key
+TRACKING_PAGE_CACHE_SIZE = 1000  # Number of normalized page paths kept in memory with their Page row
+TRACKING_THROTTLE_CACHE_SIZE = 10000  # Number of (endpoint, user) rate limit buckets kept in memory
+TRACKING_MAX_PENDING_WRITES = 8  # Page event starts are dropped while this many tracking requests are writing
+TRACKING_MAX_CLOCK_SKEW = 86400  # Seconds a page event's start_time may be from the server time (it picks the monthly partition), None to accept any
+
+# Invoice change feed settings (see invoices/sync.py)
+SYNC_PAGE_SIZE = 500  # Default and maximum number of changes returned per request
+SYNC_STREAM_TIMEOUT = 300  # Seconds before a change stream is closed (clients reconnect with Last-Event-ID)
+SYNC_STREAM_POLL_INTERVAL = 1.0  # Seconds between checks for changes made by other processes
+SYNC_STREAM_HEARTBEAT = 15  # Seconds between keep-alive comments on an idle change stream
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -144,3 +181,9 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Request profiling (see core/profiling.py)
+PROFILING_HEADER = 'HTTP_X_PROFILE'  # Staff requests sending "X-Profile: 1" are profiled
+PROFILING_SAMPLE_RATE = 0.0  # Fraction of all requests to profile (0 disables sampling)
+PROFILING_INTERVAL = 0.001  # Seconds between stack samples
+PROFILING_DIR = BASE_DIR / 'profiles'  # Where .collapsed and .queries.json files are written
@@ -4,7 +4,7 @@ from django.urls import path
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
 from django.http import HttpResponseRedirect
-from .models import Invoice, Session, PageEvent
+from .models import Invoice, Session, Page, PageEvent
 
 # Register your models here.
 @admin.register(Invoice)
@@ -99,7 +99,8 @@ class SessionAdmin(admin.ModelAdmin):
 class PageEventAdmin(admin.ModelAdmin):
     list_display = ('page', 'user', 'session', 'start_time', 'end_time', 'duration', 'is_complete')
     list_filter = ('page', 'start_time', 'user')
-    search_fields = ('page', 'user__username', 'session__session_id')
+    list_select_related = ('page', 'user', 'session__user')
+    search_fields = ('page__path', 'user__username', 'session__session_id')
     readonly_fields = ('session', 'user', 'page', 'start_time', 'end_time', 'duration')
     date_hierarchy = 'start_time'
     
@@ -108,3 +109,9 @@ class PageEventAdmin(admin.ModelAdmin):
         return obj.end_time is not None
     is_complete.boolean = True
     is_complete.short_description = 'Complete'
+
+
+@admin.register(Page)
+class PageAdmin(admin.ModelAdmin):
+    list_display = ('path', 'id')
+    search_fields = ('path',)
@@ -0,0 +1,95 @@
+"""
+Duplicate beacon suppression for tracking endpoints
+
+The frontend sends an optional `event_id` with every tracking call. Retried and
+double-fired beacons (sendBeacon + XHR fallback, unload + beforeunload) reuse the
+same id, so they can be answered from memory without touching the database.
+
+Event ids are only unique per user: another user sending the same id is not a duplicate.
+Receipts are kept for TRACKING_DEDUP_RETENTION_DAYS (see the prune_beacon_receipts command).
+"""
+import functools
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from .lru import LRUCache
+from .models import BeaconReceipt
+
+MAX_EVENT_ID_LENGTH = 64
+
+# Recently processed (user id, event id) pairs (values are unused)
+recent_event_ids = LRUCache(getattr(settings, 'TRACKING_DEDUP_CACHE_SIZE', 10000))
+
+
+def beacon_user_id(request):
+    """
+    Id of the user sending a beacon, from the token in the body or the authenticated user
+    None if unknown - the view rejects the request, so it is not deduplicated
+    """
+    token = request.data.get('token')
+    if token:
+        from rest_framework_simplejwt.tokens import UntypedToken
+        from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+        
+        try:
+            return int(UntypedToken(token)['user_id'])
+        except (InvalidToken, TokenError, KeyError, TypeError, ValueError):
+            return None
+    
+    user = request.user
+    return int(user.pk) if user and user.is_authenticated else None
+
+
+def duplicate_response(event_id):
+    """Response sent for a beacon that was already processed"""
+    return Response({'duplicate': True, 'event_id': event_id}, status=status.HTTP_200_OK)
+
+
+def deduplicate_beacon(view):
+    """
+    Decorator for tracking views - rejects beacons whose event_id was already processed
+    
+    Checks the in-memory filter first (no queries), then records a BeaconReceipt in the
+    same transaction as the view so the id is only consumed when the view succeeds.
+    A new id costs two statements on top of the view: the transaction and the receipt INSERT.
+    Requests without an event_id are passed through unchanged.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        event_id = request.data.get('event_id')
+        if not event_id:
+            return view(request, *args, **kwargs)
+        
+        event_id = str(event_id)
+        if len(event_id) > MAX_EVENT_ID_LENGTH:
+            return Response(
+                {'error': f'event_id must be at most {MAX_EVENT_ID_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        user_id = beacon_user_id(request)
+        if user_id is None:
+            return view(request, *args, **kwargs)
+        
+        key = (user_id, event_id)
+        if key in recent_event_ids:
+            return duplicate_response(event_id)
+        
+        with transaction.atomic():
+            if not BeaconReceipt.objects.claim(user_id, event_id):
+                recent_event_ids.set(key, True)
+                return duplicate_response(event_id)
+            
+            response = view(request, *args, **kwargs)
+            if response.status_code >= 400:
+                # Don't consume the id - the client may retry a failed beacon
+                transaction.set_rollback(True)
+                return response
+        
+        recent_event_ids.set(key, True)
+        return response
+    
+    return wrapper
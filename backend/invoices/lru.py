@@ -0,0 +1,48 @@
+"""
+Small thread-safe LRU cache used by the tracking views for per-process state
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used key once maxsize is reached
+    Safe to share between request threads
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return True
+            return False
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,243 @@
+"""
+manage.py generate_fixtures - populate the database with synthetic data for scale testing
+
+Generates users, invoices, sessions and page events with realistic distributions
+using a seeded random generator, so the same options always produce the same data.
+Rows are written with bulk_create in large transactions.
+"""
+import random
+import time
+from itertools import accumulate
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from invoices.models import ChangeSequence, Invoice, PageEvent, Session
+from invoices.pages import get_page
+
+CLIENT_PREFIXES = [
+    'Acme', 'Sunrise', 'Global', 'Pacific', 'Golden', 'Evergreen', 'Harbour', 'Metro',
+    'Summit', 'Lotus', 'Orchid', 'Titan', 'Nusantara', 'Borneo', 'Straits', 'Crescent',
+]
+CLIENT_SUFFIXES = ['Sdn Bhd', 'Trading', 'Enterprise', 'Holdings', 'Services', 'Logistics', 'Industries']
+DESCRIPTIONS = [
+    'Monthly maintenance fee', 'Consulting services', 'Hardware supply', 'Software license renewal',
+    'Delivery charges', 'Installation and setup', 'Quarterly retainer', None, None,
+]
+
+# Page paths (normalized route templates) and how often a page view lands on them
+PAGES = [
+    ('/dashboard', 55),
+    ('/invoices/new', 15),
+    ('/invoices/[id]/edit', 20),
+    ('/login', 7),
+    ('/', 3),
+]
+
+# Invoice age in days per expiration bucket (invoices expire 5 days after their date)
+EXPIRATION_BUCKETS = [
+    ((0, 2), 20),  # Green - 3 or more days remaining
+    ((3, 4), 15),  # Orange - expiring soon
+    ((5, 730), 65),  # Red - expired, up to two years old
+]
+
+
+PAGE_PATHS, PAGE_CUM_WEIGHTS = zip(*PAGES)
+PAGE_CUM_WEIGHTS = list(accumulate(PAGE_CUM_WEIGHTS))
+BUCKET_AGES, BUCKET_CUM_WEIGHTS = zip(*EXPIRATION_BUCKETS)
+BUCKET_CUM_WEIGHTS = list(accumulate(BUCKET_CUM_WEIGHTS))
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic users, invoices, sessions and page events for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Number of users to create')
+        parser.add_argument('--invoices', type=int, default=100_000, help='Number of invoices to create')
+        parser.add_argument('--sessions', type=int, default=200_000, help='Number of sessions to create')
+        parser.add_argument('--page-events', type=int, default=1_000_000, help='Number of page events to create')
+        parser.add_argument('--days', type=int, default=365, help='Spread sessions over this many past days')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (same seed, same data)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT statement')
+        parser.add_argument('--chunk-size', type=int, default=100_000, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        if options['page_events'] and not options['sessions']:
+            raise CommandError('--page-events requires --sessions')
+
+        self.rng = random.Random(options['seed'])
+        self.prefix = f"fixture{options['seed']}"
+        if User.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f"Fixtures for seed {options['seed']} already exist, use another --seed")
+        self.batch_size = options['batch_size']
+        self.chunk_size = options['chunk_size']
+        self.now = timezone.now()
+        self.today = timezone.localdate()
+
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # Bulk load - trade durability of this connection's writes for speed
+            # (SQLite can't change it inside a transaction, e.g. when called from tests)
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+        started = time.perf_counter()
+        user_ids = self.generate_users(options['users'])
+        self.user_weights = self.zipf_weights(len(user_ids))
+        self.user_ids = user_ids
+
+        self.generate_invoices(options['invoices'])
+        self.page_ids = [get_page(path).id for path in PAGE_PATHS]
+        self.generate_sessions(options['sessions'], options['page_events'], options['days'])
+
+        # bulk_create skips signals, cached report periods may be stale
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
+
+    def zipf_weights(self, count):
+        """Cumulative weights so a few users create most of the data"""
+        return list(accumulate(1 / (rank + 1) for rank in range(count)))
+
+    def pick_user(self):
+        return self.rng.choices(self.user_ids, cum_weights=self.user_weights)[0]
+
+    def report(self, label, count, started):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else count
+        self.stdout.write(f'{label}: {count:,} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)')
+
+    def generate_users(self, count):
+        started = time.perf_counter()
+        prefix = self.prefix
+        password = make_password(None)  # Unusable password, hashed once
+        users = [
+            User(username=f'{prefix}_{i:05d}', password=password, date_joined=self.now)
+            for i in range(count)
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=self.batch_size)
+        self.report('Users', count, started)
+        return list(User.objects.filter(username__startswith=f'{prefix}_').values_list('id', flat=True))
+
+    def invoice_date(self):
+        low, high = self.rng.choices(BUCKET_AGES, cum_weights=BUCKET_CUM_WEIGHTS)[0]
+        if high - low > 30:
+            # Older invoices get rarer
+            age = min(high, low + int(self.rng.expovariate(1 / 90)))
+        else:
+            age = self.rng.randint(low, high)
+        return self.today - timedelta(days=age), age
+
+    def generate_invoices(self, count):
+        started = time.perf_counter()
+        rng = self.rng
+        for chunk_start in range(0, count, self.chunk_size):
+            invoices = []
+            for i in range(chunk_start, min(count, chunk_start + self.chunk_size)):
+                date, age = self.invoice_date()
+                # Older invoices are more likely to be paid
+                paid = rng.random() < min(0.95, 0.2 + age / 60)
+                amount = Decimal(min(99_999_999, round(rng.lognormvariate(7.3, 1.0), 2))).quantize(Decimal('0.01'))
+                invoices.append(Invoice(
+                    invoice_no=f'INV-{i + 1:08d}',
+                    client_name=f'{rng.choice(CLIENT_PREFIXES)} {rng.choice(CLIENT_SUFFIXES)}',
+                    amount=amount,
+                    date=date,
+                    status='Paid' if paid else 'Unpaid',
+                    description=rng.choice(DESCRIPTIONS),
+                    created_by_id=self.pick_user(),
+                    is_done=paid and rng.random() < 0.8,
+                ))
+            with transaction.atomic():
+                # bulk_create skips Invoice.save(), reserve a block of change feed numbers
+                last_seq = ChangeSequence.objects.advance(Invoice.CHANGE_SEQUENCE, count=len(invoices))
+                for offset, invoice in enumerate(invoices, start=last_seq - len(invoices) + 1):
+                    invoice.change_seq = offset
+                Invoice.objects.bulk_create(invoices, batch_size=self.batch_size)
+        self.report('Invoices', count, started)
+
+    def session_start_time(self, days):
+        """Random start time, weighted to weekdays and office hours"""
+        rng = self.rng
+        while True:
+            day = self.today - timedelta(days=rng.randrange(days))
+            if day.weekday() < 5 or rng.random() < 0.25:
+                break
+        hour = min(23, max(0, int(rng.gauss(13, 3))))
+        start = datetime.combine(day, dt_time(hour, rng.randrange(60), rng.randrange(60)))
+        return timezone.make_aware(start)
+
+    def pick_page(self):
+        return self.rng.choices(self.page_ids, cum_weights=PAGE_CUM_WEIGHTS)[0]
+
+    def generate_sessions(self, session_count, event_count, days):
+        started = time.perf_counter()
+        rng = self.rng
+        session_prefix = self.prefix
+        remaining_events = event_count
+        created_events = 0
+
+        for chunk_start in range(0, session_count, self.chunk_size):
+            chunk_end = min(session_count, chunk_start + self.chunk_size)
+            sessions, session_pages = [], []
+            for i in range(chunk_start, chunk_end):
+                # Spread the remaining events over the remaining sessions
+                remaining_sessions = session_count - i
+                if remaining_sessions == 1:
+                    page_count = remaining_events
+                else:
+                    mean = remaining_events / remaining_sessions
+                    page_count = min(remaining_events, int(rng.expovariate(1 / mean))) if mean else 0
+                remaining_events -= page_count
+
+                user_id = self.pick_user()
+                start = self.session_start_time(days)
+                # Dwell time per page in seconds, median around 40s
+                dwell_times = [max(1, int(rng.lognormvariate(3.7, 1.1))) for _ in range(page_count)]
+                active = rng.random() < 0.02  # A few sessions are still open
+                duration = sum(dwell_times) + rng.randint(0, 30)
+                sessions.append(Session(
+                    session_id=f'{session_prefix}-{i:010d}',
+                    user_id=user_id,
+                    start_time=start,
+                    end_time=None if active else start + timedelta(seconds=duration),
+                    duration=None if active else duration,
+                ))
+                session_pages.append((dwell_times, active))
+
+            with transaction.atomic():
+                Session.objects.bulk_create(sessions, batch_size=self.batch_size)
+
+                events = []
+                for session, (dwell_times, active) in zip(sessions, session_pages):
+                    page_start = session.start_time
+                    for index, dwell in enumerate(dwell_times):
+                        page_end = page_start + timedelta(seconds=dwell)
+                        is_open = active and index == len(dwell_times) - 1
+                        events.append(PageEvent(
+                            session_id=session.pk,
+                            user_id=session.user_id,
+                            page_id=self.pick_page(),
+                            start_time=page_start,
+                            end_time=None if is_open else page_end,
+                            duration=None if is_open else dwell,
+                        ))
+                        page_start = page_end
+                    if len(events) >= self.batch_size * 10:
+                        PageEvent.objects.bulk_create(events, batch_size=self.batch_size)
+                        created_events += len(events)
+                        events = []
+                PageEvent.objects.bulk_create(events, batch_size=self.batch_size)
+                created_events += len(events)
+
+            self.stdout.write(f'  {chunk_end:,}/{session_count:,} sessions, {created_events:,} page events')
+
+        self.report('Sessions', session_count, started)
+        self.report('Page events', created_events, started)
@@ -0,0 +1,85 @@
+"""
+manage.py page_event_partitions - manage the monthly page event partitions
+
+    page_event_partitions                          List partitions with their row counts
+    page_event_partitions create [--ahead 2]       Create this month's partition (and the next ones)
+    page_event_partitions detach --before 2025-01  Remove old months from the view, rows are kept
+    page_event_partitions attach 2024-12           Put a detached month back in the view
+    page_event_partitions drop --before 2024-01    Delete old months (attached or detached)
+
+Detach, attach and drop only rename or drop tables, whatever the number of rows.
+See invoices/partitions.py.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.utils import timezone
+
+from invoices.partitions import (
+    DETACHED_SUFFIX, attach_partition, create_partition, detach_partition, drop_partition,
+    list_partitions, month_key, next_month, parse_month, table_name,
+)
+
+
+class Command(BaseCommand):
+    help = 'List, create, detach, attach or drop monthly page event partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action', nargs='?', default='list', choices=['list', 'create', 'detach', 'attach', 'drop'],
+        )
+        parser.add_argument('months', nargs='*', help='Months (YYYY-MM)')
+        parser.add_argument('--before', help='Every month before this one (YYYY-MM), for detach and drop')
+        parser.add_argument('--ahead', type=int, default=0, help='Also create this many months after the current one')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        action = options['action']
+        try:
+            months = [parse_month(month) for month in options['months']]
+            before = parse_month(options['before']) if options['before'] else None
+        except ValueError as e:
+            raise CommandError(e)
+
+        if action == 'list':
+            return self.list_partitions()
+
+        attached, detached = list_partitions(self.using)
+        if action == 'create':
+            if not months:
+                months = [month_key(timezone.now())]
+                for _ in range(options['ahead']):
+                    months.append(next_month(months[-1]))
+            operation = create_partition
+        else:
+            if before:
+                candidates = {
+                    'detach': attached,
+                    'attach': detached,
+                    'drop': sorted(set(attached) | set(detached)),
+                }[action]
+                months += [key for key in candidates if key < before]
+            if not months:
+                raise CommandError(f'No months to {action}, pass months or --before')
+            operation = {'detach': detach_partition, 'attach': attach_partition, 'drop': drop_partition}[action]
+
+        for key in months:
+            try:
+                operation(key, using=self.using)
+            except OperationalError as e:
+                raise CommandError(e)
+            self.stdout.write(f'{action.capitalize()}: {key[:4]}-{key[4:]}')
+
+    def list_partitions(self):
+        attached, detached = list_partitions(self.using)
+        if not attached and not detached:
+            self.stdout.write('No page event partitions')
+            return
+
+        rows = [(key, table_name(key), 'attached') for key in attached]
+        rows += [(key, table_name(key) + DETACHED_SUFFIX, 'detached') for key in detached]
+        connection = connections[self.using]
+        with connection.cursor() as cursor:
+            for key, table, state in sorted(rows):
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                self.stdout.write(f'{key[:4]}-{key[4:]}  {state:<8}  {cursor.fetchone()[0]:>12,} rows  {table}')
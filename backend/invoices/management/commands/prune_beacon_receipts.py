@@ -0,0 +1,33 @@
+"""
+manage.py prune_beacon_receipts - delete beacon receipts older than the retention window
+
+Receipts only exist to drop retried tracking beacons, which arrive within seconds or
+minutes of the first one. Run daily (e.g. from cron); beacons replayed after the
+retention window are processed again.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from invoices.models import BeaconReceipt
+
+
+class Command(BaseCommand):
+    help = 'Delete beacon receipts older than TRACKING_DEDUP_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'TRACKING_DEDUP_RETENTION_DAYS', 7),
+            help='Keep receipts received in the last DAYS days',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # No relations, a single DELETE using the received_at index
+        deleted, _ = BeaconReceipt.objects.filter(received_at__lt=cutoff).delete()
+        self.stdout.write(f'Deleted {deleted:,} beacon receipts received before {cutoff:%Y-%m-%d %H:%M}')
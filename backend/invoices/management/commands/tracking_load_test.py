@@ -0,0 +1,120 @@
+"""
+manage.py tracking_load_test - measure tracking latency for normal users while one user floods
+
+Runs against a running server (e.g. `manage.py runserver` or gunicorn), with one thread
+per simulated user:
+
+1. Baseline: every normal user visits pages (event/start + event/end) in a loop
+2. Flood: the same, while the abusing user's threads send event/start as fast as they can
+
+Prints latency percentiles and status codes of the normal users' requests for both phases,
+and the status codes of the flood. Users named `loadtest-*` are created in the database
+the server uses, with tokens minted locally, so SIMPLE_JWT settings must match the server's.
+"""
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+class Command(BaseCommand):
+    help = 'Load test the tracking endpoints of a running server with concurrent users and one abusive client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Base URL of the running server')
+        parser.add_argument('--users', type=int, default=10, help='Number of normal users (one thread each)')
+        parser.add_argument('--flood-threads', type=int, default=8, help='Threads sending requests for the abusive user')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per phase')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['flood_threads'] < 1 or options['duration'] <= 0:
+            raise CommandError('--users, --flood-threads and --duration must be positive')
+
+        self.base_url = options['url'].rstrip('/')
+        users = [self.load_test_user(f'loadtest-{i}') for i in range(options['users'])]
+        abuser = self.load_test_user('loadtest-abuser')
+        for user in users + [abuser]:
+            status, _ = self.post(user, 'session/start', {'start_time': timezone.now().isoformat()})
+            if status not in (200, 201):
+                raise CommandError(f'session/start for {user.username} returned {status}, is the server running?')
+
+        baseline = self.run_phase(users, None, 0, options['duration'])
+        flood = self.run_phase(users, abuser, options['flood_threads'], options['duration'])
+
+        self.report('Baseline', baseline['normal'])
+        self.report(f"Flood ({options['flood_threads']} threads)", flood['normal'])
+        self.stdout.write(f"  flood requests: {self.format_statuses(flood['flood'])}")
+
+    def load_test_user(self, username):
+        user, _ = User.objects.get_or_create(username=username)
+        user.token = str(AccessToken.for_user(user))
+        user.session_id = f'{username}-{int(time.time())}'
+        return user
+
+    def post(self, user, endpoint, data):
+        """POST to /api/track/<endpoint>, returns (status code, seconds)"""
+        request = urllib.request.Request(
+            f'{self.base_url}/api/track/{endpoint}',
+            data=json.dumps({'session_id': user.session_id, **data}).encode(),
+            headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {user.token}'},
+            method='POST',
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except urllib.error.URLError:
+            status = 0  # Connection refused or reset
+        return status, time.perf_counter() - started
+
+    def run_phase(self, users, abuser, flood_threads, duration):
+        """Run every thread for `duration` seconds, returns the (status, seconds) samples per kind of client"""
+        samples = {'normal': [], 'flood': []}
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def visit_pages(user):
+            results = []
+            while time.monotonic() < deadline:
+                results.append(self.post(user, 'event/start', {'page': '/dashboard', 'start_time': timezone.now().isoformat()}))
+                results.append(self.post(user, 'event/end', {'page': '/dashboard', 'end_time': timezone.now().isoformat()}))
+            with lock:
+                samples['normal'].extend(results)
+
+        def flood():
+            results = []
+            while time.monotonic() < deadline:
+                results.append(self.post(abuser, 'event/start', {'page': '/login', 'start_time': timezone.now().isoformat()}))
+            with lock:
+                samples['flood'].extend(results)
+
+        threads = [threading.Thread(target=visit_pages, args=(user,)) for user in users]
+        threads += [threading.Thread(target=flood) for _ in range(flood_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples
+
+    def format_statuses(self, samples):
+        counts = Counter(status for status, _ in samples)
+        return ', '.join(f'{status or "error"}: {count:,}' for status, count in sorted(counts.items()))
+
+    def report(self, title, samples):
+        self.stdout.write(f'{title}: {len(samples):,} requests from normal users')
+        if len(samples) < 2:
+            return
+        cuts = statistics.quantiles([seconds * 1000 for _, seconds in samples], n=100)
+        self.stdout.write(f'  latency ms: p50 {cuts[49]:.1f}, p95 {cuts[94]:.1f}, p99 {cuts[98]:.1f}')
+        self.stdout.write(f'  status codes: {self.format_statuses(samples)}')
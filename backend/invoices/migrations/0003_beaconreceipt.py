@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0002_session_pageevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BeaconReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
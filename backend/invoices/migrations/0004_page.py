@@ -0,0 +1,85 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:34
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copy of pages.normalize_page_path at the time of this migration
+ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27,}|[0-9a-fA-F]{16,})$')
+
+
+def normalize_page_path(path):
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    segments = ['[id]' if ID_SEGMENT.match(segment) else segment for segment in path.split('/')]
+    path = '/'.join(segments)
+    if len(path) > 1:
+        path = path.rstrip('/')
+    return path or '/'
+
+
+def intern_pages(apps, schema_editor):
+    """Create a Page per normalized path and point existing page events at it"""
+    Page = apps.get_model('invoices', 'Page')
+    PageEvent = apps.get_model('invoices', 'PageEvent')
+    
+    raw_paths_by_page = {}
+    for raw_path in PageEvent.objects.values_list('page_path', flat=True).distinct().iterator():
+        raw_paths_by_page.setdefault(normalize_page_path(raw_path)[:200], []).append(raw_path)
+    
+    for path, raw_paths in raw_paths_by_page.items():
+        page = Page.objects.create(path=path)
+        for i in range(0, len(raw_paths), 500):
+            PageEvent.objects.filter(page_path__in=raw_paths[i:i + 500]).update(page=page)
+
+
+def restore_page_paths(apps, schema_editor):
+    """Copy the (normalized) paths back onto page events"""
+    Page = apps.get_model('invoices', 'Page')
+    PageEvent = apps.get_model('invoices', 'PageEvent')
+    
+    for page in Page.objects.all():
+        PageEvent.objects.filter(page=page).update(page_path=page.path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_beaconreceipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Page',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('path', models.CharField(max_length=200, unique=True)),
+            ],
+        ),
+        migrations.RenameField(
+            model_name='pageevent',
+            old_name='page',
+            new_name='page_path',
+        ),
+        # Nullable while page events are migrated, so the migration can be reversed
+        migrations.AlterField(
+            model_name='pageevent',
+            name='page_path',
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='pageevent',
+            name='page',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='invoices.page'),
+        ),
+        migrations.RunPython(intern_pages, restore_page_paths),
+        migrations.RemoveField(
+            model_name='pageevent',
+            name='page_path',
+        ),
+        migrations.AlterField(
+            model_name='pageevent',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='invoices.page'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:40
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_invoices(apps, schema_editor):
+    """Put existing invoices in the change feed - ids are unique and increasing, use them as sequence numbers"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    ChangeSequence = apps.get_model('invoices', 'ChangeSequence')
+    db = schema_editor.connection.alias
+    Invoice.objects.using(db).update(change_seq=F('id'))
+    last = Invoice.objects.using(db).aggregate(last=Max('id'))['last']
+    if last:
+        ChangeSequence.objects.using(db).update_or_create(name='invoice', defaults={'value': last})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvoiceTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoice_id', models.BigIntegerField(unique=True)),
+                ('change_seq', models.PositiveBigIntegerField(db_index=True)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(number_existing_invoices, migrations.RunPython.noop),
+    ]
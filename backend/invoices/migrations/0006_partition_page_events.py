@@ -0,0 +1,98 @@
+import re
+
+from django.db import migrations
+
+# Copy of the partition schema in invoices/partitions.py at the time of this migration
+VIEW_NAME = 'invoices_pageevent'
+TABLE_PREFIX = 'invoices_pageevent_'
+TABLE_PATTERN = re.compile(rf'^{TABLE_PREFIX}(\d{{6}})$')
+ID_BLOCK = 10 ** 10
+COLUMNS = 'id, session_id, user_id, page_id, start_time, end_time, duration'
+
+CREATE_PARTITION = [
+    'CREATE TABLE "invoices_pageevent_{key}" ('
+    '"id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "session_id" bigint NOT NULL, "user_id" integer NOT NULL, '
+    '"page_id" smallint NOT NULL, "start_time" datetime NOT NULL, "end_time" datetime NULL, "duration" integer NULL)',
+    'CREATE INDEX "pe{key}_start_idx" ON "invoices_pageevent_{key}" ("start_time")',
+    'CREATE INDEX "pe{key}_session_idx" ON "invoices_pageevent_{key}" ("session_id")',
+    'CREATE INDEX "pe{key}_user_idx" ON "invoices_pageevent_{key}" ("user_id")',
+    'CREATE INDEX "pe{key}_page_idx" ON "invoices_pageevent_{key}" ("page_id")',
+]
+EMPTY_VIEW = (
+    'SELECT NULL AS "id", NULL AS "session_id", NULL AS "user_id", NULL AS "page_id", '
+    'NULL AS "start_time", NULL AS "end_time", NULL AS "duration" WHERE 0'
+)
+
+
+def table_name(key):
+    return f'{TABLE_PREFIX}{key}'
+
+
+def list_partitions(cursor):
+    """Keys of the attached partitions, oldest first"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s", [TABLE_PREFIX + '%'])
+    return sorted(match.group(1) for match in (TABLE_PATTERN.match(row[0]) for row in cursor.fetchall()) if match)
+
+
+def create_view(cursor, keys):
+    """The invoices_pageevent view over the partitions and its delete trigger"""
+    tables = [table_name(key) for key in keys]
+    select = ' UNION ALL '.join(f'SELECT {COLUMNS} FROM "{table}"' for table in tables) or EMPTY_VIEW
+    deletes = ' '.join(f'DELETE FROM "{table}" WHERE id = OLD.id;' for table in tables) or 'SELECT 1;'
+    cursor.execute(f'CREATE VIEW "{VIEW_NAME}" AS {select}')
+    cursor.execute(f'CREATE TRIGGER "{VIEW_NAME}_delete" INSTEAD OF DELETE ON "{VIEW_NAME}" BEGIN {deletes} END')
+
+
+def partition_page_events(apps, schema_editor):
+    """Move page events to one table per month, behind the invoices_pageevent view"""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE invoices_pageevent RENAME TO invoices_pageevent_unpartitioned')
+        # Datetimes are stored in UTC, like the partition keys
+        cursor.execute("SELECT DISTINCT strftime('%Y%m', start_time) FROM invoices_pageevent_unpartitioned")
+        keys = sorted(row[0] for row in cursor.fetchall())
+
+        for key in keys:
+            for sql in CREATE_PARTITION:
+                cursor.execute(sql.format(key=key))
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table_name(key), int(key) * ID_BLOCK])
+            cursor.execute(
+                f'INSERT INTO {table_name(key)} ({COLUMNS}) SELECT {COLUMNS} FROM invoices_pageevent_unpartitioned '
+                f"WHERE strftime('%%Y%%m', start_time) = %s",
+                [key],
+            )
+
+        cursor.execute('DROP TABLE invoices_pageevent_unpartitioned')
+        create_view(cursor, keys)
+
+
+def merge_page_events(apps, schema_editor):
+    """Copy the attached partitions back into a single invoices_pageevent table (detached ones are left alone)"""
+    with schema_editor.connection.cursor() as cursor:
+        keys = list_partitions(cursor)
+        cursor.execute(f'DROP VIEW IF EXISTS {VIEW_NAME}')
+    schema_editor.create_model(apps.get_model('invoices', 'PageEvent'))
+
+    with schema_editor.connection.cursor() as cursor:
+        for key in keys:
+            cursor.execute(f'INSERT INTO invoices_pageevent ({COLUMNS}) SELECT {COLUMNS} FROM {table_name(key)}')
+            cursor.execute(f'DROP TABLE {table_name(key)}')
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table_name(key)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0005_invoice_change_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_page_events, merge_page_events),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterModelOptions(
+                    name='pageevent',
+                    options={'managed': False, 'ordering': ['-start_time']},
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+def delete_receipts(apps, schema_editor):
+    """Existing receipts can't be attributed to a user - they only stop retries, drop them"""
+    BeaconReceipt = apps.get_model('invoices', 'BeaconReceipt')
+    BeaconReceipt.objects.using(schema_editor.connection.alias).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_partition_page_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_receipts, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='beaconreceipt',
+            name='user_id',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='beaconreceipt',
+            name='event_id',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='beaconreceipt',
+            name='received_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddConstraint(
+            model_name='beaconreceipt',
+            constraint=models.UniqueConstraint(fields=('user_id', 'event_id'), name='unique_beacon_receipt_per_user'),
+        ),
+    ]
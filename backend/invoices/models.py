@@ -3,7 +3,47 @@ from django.contrib.auth.models import User
 from datetime import timedelta
 from django.utils import timezone
 
+class ChangeSequenceManager(models.Manager):
+    def advance(self, name, count=1, using=None):
+        """
+        Increment the named counter by count in a single INSERT ... ON CONFLICT ... RETURNING statement
+        
+        Returns the new value - the last of the count reserved numbers.
+        Requires SQLite 3.35+ or PostgreSQL.
+        """
+        from django.db import router
+        
+        db = using or router.db_for_write(self.model)
+        table = self.model._meta.db_table
+        sql = f"""
+            INSERT INTO {table} (name, value) VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE SET value = {table}.value + excluded.value
+            RETURNING name, value
+        """
+        return list(self.raw(sql, [name, count]).using(db))[0].value
+    
+    def current(self, name, using=None):
+        """Current value of the named counter (0 if it was never advanced)"""
+        value = self.using(using).filter(name=name).values_list('value', flat=True).first()
+        return value or 0
+
+
+class ChangeSequence(models.Model):
+    """
+    Named monotonic counters, e.g. the position in the invoice change feed
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.PositiveBigIntegerField(default=0)  # Last number handed out
+    
+    objects = ChangeSequenceManager()
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
 class Invoice(models.Model):
+    CHANGE_SEQUENCE = 'invoice'  # ChangeSequence counter of the invoice change feed
+    
     STATUS_CHOICES = [
         ('Paid', 'Paid'),
         ('Unpaid', 'Unpaid'),
@@ -17,10 +57,34 @@ class Invoice(models.Model):
     description = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     is_done = models.BooleanField(default=False, verbose_name='Done')
+    updated_at = models.DateTimeField(auto_now=True)  # When the invoice was last modified
+    # Position in the change feed (see sync.py), assigned on every save
+    # Note: QuerySet.update() and bulk_create() bypass save() and must set it themselves
+    change_seq = models.PositiveBigIntegerField(default=0, db_index=True, editable=False)
 
     def __str__(self):
         return self.invoice_no
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored date, so saving doesn't need to query it (see signals.py)
+        instance._stored_date = instance.__dict__.get('date')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        from django.db import router, transaction
+        
+        # Take the sequence number in the same transaction as the write, so the counter row
+        # stays locked until commit and changes become visible in sequence order
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        if kwargs.get('update_fields'):
+            # A partial save is still a change - it must move in the feed and touch updated_at
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'change_seq', 'updated_at'}
+        with transaction.atomic(using=using):
+            self.change_seq = ChangeSequence.objects.advance(Invoice.CHANGE_SEQUENCE, using=using)
+            super().save(*args, **kwargs)
+    
     def get_expiration_date(self):
         """Returns the expiration date (5 days from invoice date)"""
         return self.date + timedelta(days=5)
@@ -60,6 +124,62 @@ class Invoice(models.Model):
         else:
             return f"Expired {abs(days_remaining)} day(s) ago"
 
+class SessionManager(models.Manager):
+    def upsert(self, session_id, user, start_time, restart_ended=True):
+        """
+        Get or create a session, returns (session, created) like get_or_create
+        
+        - New session_id: inserts the session with start_time
+        - Existing ended session: restarts it at start_time if restart_ended, else returns it as is
+        - Existing active session: returns it unchanged
+        
+        Sessions are usually new when restart_ended (session start) and already exist
+        otherwise (page events), so the statement for the usual case runs first - an
+        INSERT ... ON CONFLICT DO NOTHING RETURNING, or an UPDATE/SELECT ... RETURNING of
+        the user's session - and the other one only on a miss.
+        Returns (None, False) if session_id already belongs to another user.
+        Requires SQLite 3.35+ or PostgreSQL.
+        """
+        from django.db import connections, router
+        
+        db = router.db_for_write(self.model)
+        table = self.model._meta.db_table
+        connection = connections[db]
+        columns = 'id, session_id, user_id, start_time, end_time, last_ping, duration'
+        # user may be a TokenUser, whose pk is the token's user_id claim (a string)
+        user_id = int(user.pk)
+        start_time = connection.ops.adapt_datetimefield_value(start_time)
+        
+        insert = (f"""
+            INSERT INTO {table} (session_id, user_id, start_time, end_time, last_ping, duration)
+            VALUES (%s, %s, %s, NULL, NULL, NULL)
+            ON CONFLICT (session_id) DO NOTHING
+            RETURNING {columns}
+        """, [session_id, user_id, start_time])
+        if restart_ended:
+            existing = (f"""
+                UPDATE {table} SET
+                    start_time = CASE WHEN end_time IS NULL THEN start_time ELSE %s END,
+                    end_time = NULL,
+                    duration = NULL
+                WHERE session_id = %s AND user_id = %s
+                RETURNING {columns}
+            """, [start_time, session_id, user_id])
+            attempts = [(insert, True), (existing, False)]
+        else:
+            existing = (f'SELECT {columns} FROM {table} WHERE session_id = %s AND user_id = %s', [session_id, user_id])
+            attempts = [(existing, False), (insert, True)]
+        # The first statement again if the row was inserted or deleted concurrently in between
+        attempts.append(attempts[0])
+        
+        for (sql, params), created in attempts:
+            # raw() applies the backend's converters (e.g. timezone-aware datetimes on SQLite)
+            rows = list(self.raw(sql, params).using(db))
+            if rows:
+                return rows[0], created
+        return None, False
+
+
 class Session(models.Model):
     """
     Tracks user sessions - from when they open the app until they leave
@@ -71,6 +191,8 @@ class Session(models.Model):
     last_ping = models.DateTimeField(null=True, blank=True)  # DEPRECATED: Not used anymore (kept for database compatibility)
     duration = models.IntegerField(null=True, blank=True)  # Total session duration in seconds
     
+    objects = SessionManager()
+    
     def __str__(self):
         return f"Session {self.session_id} - {self.user.username}"
     
@@ -78,19 +200,113 @@ class Session(models.Model):
         ordering = ['-start_time']  # Newest sessions first
 
 
+class Page(models.Model):
+    """
+    Distinct page paths referenced by page events
+    Paths are normalized to route templates (e.g., "/invoices/[id]/edit"), see pages.py
+    """
+    id = models.SmallAutoField(primary_key=True)
+    path = models.CharField(max_length=200, unique=True)  # Normalized page path
+    
+    def __str__(self):
+        return self.path
+
+
+class PageEventQuerySet(models.QuerySet):
+    """Routes page event writes to the monthly partitions, see partitions.py"""
+    def between(self, start, end):
+        """Events with start_time in [start, end), reading only the partitions of that range"""
+        from .partitions import restrict_to_range
+        return restrict_to_range(self, start, end)
+    
+    def bulk_create(self, objs, batch_size=None, **kwargs):
+        from .partitions import bulk_create_page_events
+        return bulk_create_page_events(list(objs), self.db, batch_size=batch_size, **kwargs)
+    
+    def bulk_update(self, objs, fields, batch_size=None):
+        from .partitions import bulk_update_page_events
+        return bulk_update_page_events(list(objs), fields, self.db, batch_size=batch_size)
+    
+    def update(self, **kwargs):
+        from .partitions import update_page_events
+        return update_page_events(self, kwargs)
+
+
 class PageEvent(models.Model):
     """
     Tracks individual page views - how long user stays on each page
+    Read from the invoices_pageevent view over the monthly partitions, see partitions.py
     """
     session = models.ForeignKey(Session, on_delete=models.CASCADE)  # Which session this belongs to
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # Which user
-    page = models.CharField(max_length=200)  # Page path (e.g., "/dashboard", "/invoices/new")
+    page = models.ForeignKey(Page, on_delete=models.PROTECT)  # Page path (e.g., "/dashboard", "/invoices/new")
     start_time = models.DateTimeField()  # When user entered the page
     end_time = models.DateTimeField(null=True, blank=True)  # When user left the page
     duration = models.IntegerField(null=True, blank=True)  # How long on page (in seconds)
     
+    objects = PageEventQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.user.username} - {self.page} ({self.duration}s)"
     
+    def save(self, *args, **kwargs):
+        # Written to the partition of start_time's month
+        from .partitions import save_page_event
+        save_page_event(self, *args, **kwargs)
+    
+    class Meta:
+        ordering = ['-start_time']  # Newest events first
+        managed = False  # View over the monthly partitions, created by migration 0006
+
+class BeaconReceiptManager(models.Manager):
+    def claim(self, user_id, event_id):
+        """
+        Record (user_id, event_id) in a single INSERT ... ON CONFLICT DO NOTHING statement
+        
+        Returns False if the pair was already recorded. Unlike create() and catching
+        IntegrityError, a duplicate needs no savepoint to keep the transaction usable.
+        Requires SQLite 3.35+ or PostgreSQL.
+        """
+        from django.db import connections, router
+        
+        db = router.db_for_write(self.model)
+        table = self.model._meta.db_table
+        sql = f"""
+            INSERT INTO {table} (user_id, event_id, received_at) VALUES (%s, %s, %s)
+            ON CONFLICT (user_id, event_id) DO NOTHING
+            RETURNING id, user_id, event_id, received_at
+        """
+        received_at = connections[db].ops.adapt_datetimefield_value(timezone.now())
+        return bool(list(self.raw(sql, [user_id, event_id, received_at]).using(db)))
+
+
+class BeaconReceipt(models.Model):
+    """
+    Records client-generated event ids of tracking beacons that were processed
+    Database fallback for duplicate detection (the in-memory filter misses after a restart)
+    """
+    user_id = models.BigIntegerField()  # User who sent the beacon (event ids are unique per user)
+    event_id = models.CharField(max_length=64)  # UUID generated by the frontend
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)  # When the beacon was first processed
+    
+    objects = BeaconReceiptManager()
+    
+    def __str__(self):
+        return self.event_id
+    
     class Meta:
-        ordering = ['-start_time']  # Newest events first
\ No newline at end of file
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'event_id'], name='unique_beacon_receipt_per_user'),
+        ]
+
+
+class InvoiceTombstone(models.Model):
+    """
+    Marks a deleted invoice in the change feed so synced clients can drop it
+    """
+    invoice_id = models.BigIntegerField(unique=True)  # Id of the deleted invoice
+    change_seq = models.PositiveBigIntegerField(db_index=True)  # Position in the change feed
+    deleted_at = models.DateTimeField(default=timezone.now)  # When the invoice was deleted
+    
+    def __str__(self):
+        return f"Invoice {self.invoice_id} deleted"
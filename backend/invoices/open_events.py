@@ -0,0 +1,69 @@
+"""
+Per-process index of open page events
+
+event_start remembers the primary key and start time of the event it created,
+keyed by (user, session, page). event_end can then close the event with a single
+conditional UPDATE instead of looking up the session and the latest open event.
+On a miss (other worker, restart, eviction) the caller falls back to the lookup.
+"""
+from django.conf import settings
+from django.db import OperationalError, connections, router
+
+from .lru import LRUCache
+from .models import PageEvent
+from .partitions import month_key, table_name
+
+open_page_events = LRUCache(getattr(settings, 'TRACKING_OPEN_EVENT_CACHE_SIZE', 10000))
+
+
+def remember_open_event(page_event, session_id):
+    """Cache the handle of a newly started page event"""
+    key = (str(page_event.user_id), str(session_id), page_event.page_id)
+    open_page_events.set(key, (page_event.id, page_event.session_id, page_event.user_id, page_event.start_time))
+
+
+def close_open_event(user_id, session_id, page, end_time, duration=None):
+    """
+    Close the cached open event for (user, session, page) with one UPDATE
+    page is a Page (see pages.get_page)
+    Returns the closed PageEvent (not refetched), or None if the caller must fall back
+    """
+    # Token claims carry the user id as a string, compact beacons may send a numeric session id
+    handle = open_page_events.pop((str(user_id), str(session_id), page.id))
+    if handle is None:
+        return None
+    
+    page_event_id, session_pk, user_pk, start_time = handle
+    if duration is None:
+        duration = int((end_time - start_time).total_seconds())
+    
+    # end_time IS NULL guards against events already closed by session_end or another worker
+    # The start time gives the partition, so only that table is updated
+    connection = connections[router.db_for_write(PageEvent)]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {connection.ops.quote_name(table_name(month_key(start_time)))} '
+                'SET end_time = %s, duration = %s WHERE id = %s AND end_time IS NULL',
+                [connection.ops.adapt_datetimefield_value(end_time), duration, page_event_id],
+            )
+            updated = cursor.rowcount
+    except OperationalError as e:
+        # The partition was detached since the event started, the event is no longer visible like
+        # an ended one. SQLite fails before running the statement and, unlike QuerySet.update(),
+        # a plain cursor doesn't mark the caller's transaction (beacons with an event_id) for rollback
+        if 'no such table' not in str(e):
+            raise
+        updated = 0
+    if not updated:
+        return None
+    
+    return PageEvent(
+        id=page_event_id,
+        session_id=session_pk,
+        user_id=user_pk,
+        page=page,
+        start_time=start_time,
+        end_time=end_time,
+        duration=duration
+    )
@@ -0,0 +1,58 @@
+"""
+Page path normalization and interning
+
+Page events reference a Page row instead of storing the path string. Concrete
+ids in paths are replaced with route template placeholders, so the number of
+distinct pages stays close to the number of frontend routes:
+
+    /invoices/42/edit?tab=1  ->  /invoices/[id]/edit
+
+Resolved pages are cached per process, so tracking views map a path to its
+Page without a query once the page has been seen.
+"""
+import re
+
+from django.conf import settings
+
+from .lru import LRUCache
+from .models import Page
+
+MAX_PATH_LENGTH = Page._meta.get_field('path').max_length
+
+# Numeric ids and UUID / long hex ids
+ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27,}|[0-9a-fA-F]{16,})$')
+
+# Normalized path -> Page
+page_cache = LRUCache(getattr(settings, 'TRACKING_PAGE_CACHE_SIZE', 1000))
+
+
+def normalize_page_path(path):
+    """Strip query string and fragment, replace id segments with [id]"""
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    segments = ['[id]' if ID_SEGMENT.match(segment) else segment for segment in path.split('/')]
+    path = '/'.join(segments)
+    if len(path) > 1:
+        path = path.rstrip('/')
+    return path or '/'
+
+
+def get_page(path, create=True):
+    """
+    Page for a (raw) page path, created if needed
+    Returns None if the path is too long, or if it doesn't exist and create is False
+    """
+    path = normalize_page_path(path)
+    page = page_cache.get(path)
+    if page is not None:
+        return page
+    
+    if len(path) > MAX_PATH_LENGTH:
+        return None
+    if create:
+        page, _ = Page.objects.get_or_create(path=path)
+    else:
+        page = Page.objects.filter(path=path).first()
+        if page is None:
+            return None
+    page_cache.set(path, page)
+    return page
@@ -0,0 +1,109 @@
+"""
+Request parsers for the tracking endpoints
+
+Besides regular JSON, tracking views accept:
+- gzip-compressed JSON (`Content-Encoding: gzip`), for fetch/XHR requests
+- a compact positional beacon (`application/x-beacon`): a JSON array of the
+  view's fields in a fixed order, with times as epoch milliseconds, optionally
+  gzip-compressed. Used by sendBeacon, which cannot set request headers.
+"""
+import json
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.settings import api_settings
+
+GZIP_MAGIC = b'\x1f\x8b'
+MAX_BEACON_SIZE = 64 * 1024  # Decompressed size limit, guards against gzip bombs
+
+# Fields sent as epoch milliseconds in compact beacons
+TIME_FIELDS = ('start_time', 'end_time')
+
+
+def _read_body(stream, parser_context):
+    """Read the request body, decompressing it if it is gzipped"""
+    body = stream.read() if stream is not None else b''
+    request = (parser_context or {}).get('request')
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '') if request is not None else ''
+    if encoding.lower() == 'gzip' or body[:2] == GZIP_MAGIC:
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BEACON_SIZE)
+        except zlib.error as exc:
+            raise ParseError(f'Invalid gzip body - {exc}')
+        if decompressor.unconsumed_tail:
+            raise ParseError(f'Decompressed body exceeds {MAX_BEACON_SIZE} bytes')
+    return body
+
+
+def parse_timestamp(value):
+    """
+    Parse a tracking timestamp (datetime, ISO 8601 string or epoch milliseconds)
+    Returns None if the value can't be parsed
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            # Out of the platform's range (or NaN/Infinity)
+            return None
+    if isinstance(value, str):
+        try:
+            return parse_datetime(value)
+        except ValueError:
+            return None
+    return None
+
+
+class GzipJSONParser(JSONParser):
+    """JSON parser that also accepts gzip-compressed bodies"""
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        body = _read_body(stream, parser_context)
+        try:
+            return json.loads(body.decode(encoding)) if body else {}
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class BeaconParser(BaseParser):
+    """
+    Parser for compact positional beacons
+    Subclasses set `fields` to the positional field names (see beacon_parser)
+    """
+    media_type = 'application/x-beacon'
+    fields = ()
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = _read_body(stream, parser_context)
+        try:
+            values = json.loads(body)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError(f'Beacon parse error - {exc}')
+        if not isinstance(values, list) or len(values) > len(self.fields):
+            raise ParseError(f"Beacon must be an array of at most {len(self.fields)} values: {', '.join(self.fields)}")
+        
+        data = dict(zip(self.fields, values))
+        for name in TIME_FIELDS:
+            if isinstance(data.get(name), (int, float)):
+                data[name] = parse_timestamp(data[name])
+                if data[name] is None:
+                    raise ParseError(f'Beacon {name} must be epoch milliseconds')
+        return data
+
+
+def beacon_parser(*fields):
+    """Build a BeaconParser for the given positional fields"""
+    return type('BeaconParser', (BeaconParser,), {'fields': fields})
+
+
+def tracking_parsers(*fields):
+    """Parser classes for a tracking view: gzip-aware JSON, compact beacons, then the defaults"""
+    defaults = [parser for parser in api_settings.DEFAULT_PARSER_CLASSES if parser is not JSONParser]
+    return [GzipJSONParser, beacon_parser(*fields)] + defaults
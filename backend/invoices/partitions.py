@@ -0,0 +1,379 @@
+"""
+Monthly partitions of page events
+
+Page events are stored in one table per month of their start_time (UTC), named
+invoices_pageevent_YYYYMM. The PageEvent model reads from the invoices_pageevent
+view, a UNION ALL of the attached partitions, so the admin and any query on
+PageEvent span every partition transparently.
+
+Writes are routed by start_time:
+- PageEvent.save(), bulk_create() and bulk_update() write to the partition of each
+  event's month, creating the partition on first use
+- QuerySet.update() runs on every partition, restricted to the matching ids
+- Deletes go through the view (INSTEAD OF DELETE trigger), so cascades keep working
+  (SQLite doesn't count rows deleted by the trigger in the returned delete counts)
+
+PageEvent.objects.between(start, end) reads only the partitions overlapping the range.
+
+Old months are removed without touching their rows (see the page_event_partitions
+command): detaching renames the table out of the view, dropping deletes the table.
+Writes to a detached month raise PartitionUnavailable.
+
+Ids of a partition start at YYYYMM * 10^10, so they are unique across partitions and
+stay below 2^53 for JavaScript clients. Partitions have no database-level foreign
+keys: cascades are handled by Django through the view, and detached partitions may
+outlive the sessions and users they reference.
+
+SQLite only. Schema changes to PageEvent must be applied to every partition.
+"""
+import re
+import threading
+from datetime import datetime, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, models, router, transaction
+from django.db.models.sql.datastructures import BaseTable
+
+VIEW_NAME = 'invoices_pageevent'
+TABLE_PREFIX = 'invoices_pageevent_'
+DETACHED_SUFFIX = '_detached'
+TABLE_PATTERN = re.compile(rf'^{TABLE_PREFIX}(\d{{6}})({DETACHED_SUFFIX})?$')
+ID_BLOCK = 10 ** 10  # Ids per partition, the first id of a partition is YYYYMM * ID_BLOCK + 1
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+class PartitionUnavailable(OperationalError):
+    """The partition of a month is detached - its events can't be written until it is attached"""
+
+
+# ---- Months ----
+
+def month_key(value):
+    """Partition key (YYYYMM) of a start_time (datetime or ISO string)"""
+    from .models import PageEvent
+
+    value = PageEvent._meta.get_field('start_time').to_python(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc)
+    return f'{value.year:04d}{value.month:02d}'
+
+
+def parse_month(value):
+    """Partition key from "YYYY-MM" or "YYYYMM", raises ValueError if invalid"""
+    match = re.fullmatch(r'(\d{4})-?(\d{2})', value.strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f'Invalid month "{value}", use YYYY-MM')
+    return match.group(1) + match.group(2)
+
+
+def month_start(key):
+    """First instant of a partition's month"""
+    start = datetime(int(key[:4]), int(key[4:]), 1)
+    return start.replace(tzinfo=dt_timezone.utc) if settings.USE_TZ else start
+
+
+def next_month(key):
+    year, month = int(key[:4]), int(key[4:])
+    return f'{year + month // 12:04d}{month % 12 + 1:02d}'
+
+
+def table_name(key):
+    return f'{TABLE_PREFIX}{key}'
+
+
+# ---- Partition models ----
+
+def partition_model(key):
+    """Model class reading and writing the partition of a month (built once per process)"""
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = _build_partition_model(key)
+        return model
+
+
+def _build_partition_model(key):
+    from .models import PageEvent
+
+    attrs = {'__module__': PageEvent.__module__, 'id': type(PageEvent._meta.pk)(primary_key=True)}
+    indexes = [models.Index(fields=['start_time'], name=f'pe{key}_start_idx')]
+    for field in PageEvent._meta.local_fields:
+        if field.primary_key:
+            continue
+        name, path, args, kwargs = field.deconstruct()
+        if field.is_relation:
+            # Relations are enforced through the view, see the module docstring
+            kwargs.update(on_delete=models.DO_NOTHING, related_name='+', db_constraint=False, db_index=False)
+            indexes.append(models.Index(fields=[name], name=f'pe{key}_{name}_idx'))
+        attrs[name] = type(field)(*args, **kwargs)
+
+    attrs['Meta'] = type('Meta', (), {
+        'app_label': PageEvent._meta.app_label,
+        'db_table': table_name(key),
+        'managed': False,
+        'default_permissions': (),
+        'indexes': indexes,
+    })
+    return type(f'PageEventPartition{key}', (models.Model,), attrs)
+
+
+# ---- Partition tables ----
+
+def list_partitions(using=DEFAULT_DB_ALIAS):
+    """(attached, detached) partition keys, oldest first"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s",
+            [TABLE_PREFIX + '%'],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    attached, detached = [], []
+    for name in names:
+        match = TABLE_PATTERN.match(name)
+        if match:
+            (detached if match.group(2) else attached).append(match.group(1))
+    return sorted(attached), sorted(detached)
+
+
+def union_sql(connection, tables):
+    """SELECT of every PageEvent column over the UNION ALL of tables"""
+    from .models import PageEvent
+
+    quote = connection.ops.quote_name
+    columns = [field.column for field in PageEvent._meta.concrete_fields]
+    if not tables:
+        return 'SELECT ' + ', '.join(f'NULL AS {quote(column)}' for column in columns) + ' WHERE 0'
+    select = ', '.join(quote(column) for column in columns)
+    return ' UNION ALL '.join(f'SELECT {select} FROM {quote(table)}' for table in tables)
+
+
+def rebuild_view(using=DEFAULT_DB_ALIAS):
+    """Recreate the invoices_pageevent view and its delete trigger over the attached partitions"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    tables = [table_name(key) for key in list_partitions(using)[0]]
+    # Deletes through the view (admin, cascades) are applied to every partition by id
+    deletes = ' '.join(f'DELETE FROM {quote(table)} WHERE id = OLD.id;' for table in tables) or 'SELECT 1;'
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'DROP VIEW IF EXISTS {quote(VIEW_NAME)}')
+        cursor.execute(f'CREATE VIEW {quote(VIEW_NAME)} AS {union_sql(connection, tables)}')
+        cursor.execute(
+            f'CREATE TRIGGER {quote(VIEW_NAME + "_delete")} INSTEAD OF DELETE ON {quote(VIEW_NAME)} '
+            f'BEGIN {deletes} END'
+        )
+
+
+def create_partition(key, using=DEFAULT_DB_ALIAS):
+    """Create the partition of a month (if missing) and add it to the view"""
+    connection = connections[using]
+    model = partition_model(key)
+
+    with transaction.atomic(using=using):
+        attached, detached = list_partitions(using)
+        if key in attached:
+            return model
+        if key in detached:
+            raise PartitionUnavailable(f'Page event partition {key} is detached, attach or drop it first')
+
+        # The schema editor is only used to generate the SQL: entering it isn't allowed inside
+        # a transaction on SQLite, and partitions are created inside tracking requests
+        editor = connection.schema_editor(collect_sql=True)
+        sql, params = editor.table_sql(model)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params or None)
+            for index in model._meta.indexes:
+                cursor.execute(str(index.create_sql(model, editor)))
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                [table_name(key), int(key) * ID_BLOCK],
+            )
+        rebuild_view(using)
+    return model
+
+
+def detach_partition(key, using=DEFAULT_DB_ALIAS):
+    """Remove a partition from the view - its rows stay in the database, untouched"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=using):
+        if key not in list_partitions(using)[0]:
+            raise OperationalError(f'Page event partition {key} is not attached')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP VIEW IF EXISTS {quote(VIEW_NAME)}')
+            cursor.execute(f'ALTER TABLE {quote(table_name(key))} RENAME TO {quote(table_name(key) + DETACHED_SUFFIX)}')
+        rebuild_view(using)
+
+
+def attach_partition(key, using=DEFAULT_DB_ALIAS):
+    """Add a detached partition back to the view"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=using):
+        attached, detached = list_partitions(using)
+        if key not in detached:
+            raise OperationalError(f'Page event partition {key} is not detached')
+        if key in attached:
+            raise OperationalError(f'Page event partition {key} already exists')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP VIEW IF EXISTS {quote(VIEW_NAME)}')
+            cursor.execute(f'ALTER TABLE {quote(table_name(key) + DETACHED_SUFFIX)} RENAME TO {quote(table_name(key))}')
+        rebuild_view(using)
+
+
+def drop_partition(key, using=DEFAULT_DB_ALIAS):
+    """Delete a partition (attached or detached) with all its rows"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=using):
+        attached, detached = list_partitions(using)
+        if key not in attached and key not in detached:
+            raise OperationalError(f'Page event partition {key} does not exist')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP VIEW IF EXISTS {quote(VIEW_NAME)}')
+            for name in (table_name(key), table_name(key) + DETACHED_SUFFIX):
+                cursor.execute(f'DROP TABLE IF EXISTS {quote(name)}')
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table_name(key)])
+        rebuild_view(using)
+
+
+# ---- Routing ----
+
+def write_to_partition(key, write, using):
+    """
+    Run write() against the partition of a month, creating the partition if it doesn't exist yet
+    Raises PartitionUnavailable if the month is detached. Callers writing client-supplied
+    times must bound them first, every new month adds a table to the view.
+    """
+    try:
+        # Savepoint, so a missing table doesn't break the caller's transaction
+        with transaction.atomic(using=using):
+            return write()
+    except OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+    create_partition(key, using)
+    return write()
+
+
+def _copy(event, model, attnames):
+    """Instance of a partition model with the given field values of event"""
+    copy = model(**{attname: getattr(event, attname) for attname in attnames})
+    copy._state.adding = event._state.adding
+    return copy
+
+
+def save_page_event(event, force_insert=False, force_update=False, using=None, update_fields=None):
+    """PageEvent.save() - insert or update the event in its month's partition"""
+    opts = type(event)._meta
+    using = using or router.db_for_write(type(event), instance=event)
+    adding = event._state.adding or event.pk is None
+
+    if update_fields is None and not adding and event.get_deferred_fields():
+        # Like Model.save(), only save the loaded fields of a deferred instance
+        update_fields = [f.name for f in opts.concrete_fields if f.attname not in event.get_deferred_fields()]
+    if update_fields is not None:
+        update_fields = [opts.get_field(name).name for name in update_fields if not opts.get_field(name).primary_key]
+        attnames = [opts.pk.attname] + [opts.get_field(name).attname for name in update_fields]
+    else:
+        attnames = [field.attname for field in opts.concrete_fields]
+
+    key = month_key(event.start_time)
+    copy = _copy(event, partition_model(key), attnames)
+    if adding:
+        write_to_partition(key, partial(copy.save, force_insert=True, using=using), using)
+    else:
+        # Never fall back to an insert - the event belongs to the partition of its start_time
+        copy.save(force_update=True, using=using, update_fields=update_fields)
+
+    event.pk = copy.pk
+    event._state.adding = False
+    event._state.db = using
+
+
+def _by_partition(events):
+    groups = {}
+    for event in events:
+        groups.setdefault(month_key(event.start_time), []).append(event)
+    return groups
+
+
+def bulk_create_page_events(events, using, batch_size=None, **kwargs):
+    """QuerySet.bulk_create() - one bulk insert per partition"""
+    for key, group in _by_partition(events).items():
+        model = partition_model(key)
+        attnames = [field.attname for field in model._meta.concrete_fields]
+        copies = [_copy(event, model, attnames) for event in group]
+        write_to_partition(
+            key, partial(model.objects.using(using).bulk_create, copies, batch_size=batch_size, **kwargs), using,
+        )
+        for event, copy in zip(group, copies):
+            event.pk = copy.pk
+            event._state.adding = False
+            event._state.db = using
+    return events
+
+
+def bulk_update_page_events(events, fields, using, batch_size=None):
+    """QuerySet.bulk_update() - one bulk update per partition"""
+    from .models import PageEvent
+
+    attnames = [PageEvent._meta.pk.attname] + [PageEvent._meta.get_field(name).attname for name in fields]
+    updated = 0
+    for key, group in _by_partition(events).items():
+        model = partition_model(key)
+        copies = [_copy(event, model, attnames) for event in group]
+        updated += model.objects.using(using).bulk_update(copies, fields, batch_size=batch_size)
+    return updated
+
+
+def update_page_events(queryset, values):
+    """QuerySet.update() - update the matching events in every partition"""
+    if 'start_time' in values:
+        raise ValueError('start_time decides the partition of a page event and cannot be updated')
+
+    ids = queryset.values('pk')
+    updated = 0
+    for key in list_partitions(queryset.db)[0]:
+        updated += partition_model(key).objects.using(queryset.db).filter(pk__in=ids).update(**values)
+    return updated
+
+
+class PartitionTable(BaseTable):
+    """FROM clause of the invoices_pageevent view reading only some of its partitions"""
+    def __init__(self, table_name, alias, partition_tables):
+        super().__init__(table_name, alias)
+        self.partition_tables = tuple(partition_tables)
+
+    def as_sql(self, compiler, connection):
+        quote = connection.ops.quote_name
+        if len(self.partition_tables) == 1:
+            return f'{quote(self.partition_tables[0])} {quote(self.table_alias)}', []
+        return f'({union_sql(connection, self.partition_tables)}) {quote(self.table_alias)}', []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(self.table_name, change_map.get(self.table_alias, self.table_alias), self.partition_tables)
+
+    @property
+    def identity(self):
+        return *super().identity, self.partition_tables
+
+
+def restrict_to_range(queryset, start, end):
+    """Page events with start_time in [start, end), read from the overlapping partitions only"""
+    from .models import PageEvent
+
+    first, last = month_key(start), month_key(end)
+    # end is exclusive, a range ending on the first instant of a month doesn't read that month
+    end_on_boundary = PageEvent._meta.get_field('start_time').to_python(end) == month_start(last)
+    attached = list_partitions(queryset.db)[0]
+    keys = [key for key in attached if first <= key < last or (key == last and not end_on_boundary)]
+
+    queryset = queryset.filter(start_time__gte=start, start_time__lt=end)
+    alias = queryset.query.get_initial_alias()
+    queryset.query.alias_map[alias] = PartitionTable(VIEW_NAME, alias, [table_name(key) for key in keys])
+    return queryset
@@ -0,0 +1,134 @@
+"""
+Invoice revenue report - totals per day/week/month split by status and by creator
+
+Each period is aggregated independently and periods that ended before today are
+cached without expiry, so a report only queries the database for the current
+(open) period and for closed periods whose cache entry was dropped because an
+invoice in them was written (see signals.py).
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Invoice
+
+GRANULARITIES = ('day', 'week', 'month')
+MAX_PERIODS = 1000  # Upper bound on periods in a single report
+CACHE_KEY_PREFIX = 'invoice_report:v1'
+CENTS = Decimal('0.01')
+
+
+def period_start(day, granularity):
+    """Truncate a date to the first day of its period (weeks start on Monday)"""
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_period_start(start, granularity):
+    """First day of the period following the one starting at start"""
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if start.month == 12:
+        return date(start.year + 1, 1, 1)
+    return date(start.year, start.month + 1, 1)
+
+
+def period_starts(start, end, granularity):
+    """All period starts covering [start, end]"""
+    periods = []
+    current = period_start(start, granularity)
+    while current <= end:
+        periods.append(current)
+        current = next_period_start(current, granularity)
+    return periods
+
+
+def cache_key(granularity, start):
+    return f'{CACHE_KEY_PREFIX}:{granularity}:{start.isoformat()}'
+
+
+def invalidate_date(day):
+    """Drop cached report periods containing day, for every granularity"""
+    if isinstance(day, str):
+        day = parse_date(day)
+    cache.delete_many([cache_key(g, period_start(day, g)) for g in GRANULARITIES])
+
+
+def _empty_period():
+    return {'total': Decimal('0'), 'count': 0, 'by_status': {}, 'by_creator': {}}
+
+
+def _add(bucket, total, count):
+    bucket['total'] = str((Decimal(bucket.get('total', '0')) + total).quantize(CENTS))
+    bucket['count'] = bucket.get('count', 0) + count
+
+
+def _date_ranges(periods, granularity):
+    """Contiguous runs of periods as (start, end) date ranges, end exclusive"""
+    ranges = []
+    for start in periods:
+        end = next_period_start(start, granularity)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def _aggregate(periods, granularity):
+    """Aggregate the given periods (ordered) with a single grouped query reading only their dates"""
+    results = {start: _empty_period() for start in periods}
+    in_periods = Q()
+    for start, end in _date_ranges(periods, granularity):
+        in_periods |= Q(date__gte=start, date__lt=end)
+    rows = (
+        Invoice.objects
+        .filter(in_periods)
+        .annotate(period=Trunc('date', granularity, output_field=DateField()))
+        .values('period', 'status', 'created_by')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    for row in rows:
+        period = results[row['period']]
+        period['total'] += row['total']
+        period['count'] += row['count']
+        _add(period['by_status'].setdefault(row['status'], {}), row['total'], row['count'])
+        _add(period['by_creator'].setdefault(str(row['created_by']), {}), row['total'], row['count'])
+    for period in results.values():
+        period['total'] = str(period['total'].quantize(CENTS))
+    return results
+
+
+def build_report(start, end, granularity):
+    """
+    Returns the series for [start, end] as a list of dicts ordered by period
+    Closed periods are served from cache; the rest are recomputed in one query over their own dates
+    """
+    periods = period_starts(start, end, granularity)
+    today = timezone.localdate()
+    closed = {p for p in periods if next_period_start(p, granularity) <= today}
+    
+    cached = cache.get_many([cache_key(granularity, p) for p in closed])
+    results = {p: cached[cache_key(granularity, p)] for p in closed if cache_key(granularity, p) in cached}
+    
+    missing = [p for p in periods if p not in results]
+    if missing:
+        computed = _aggregate(missing, granularity)
+        results.update(computed)
+        cache.set_many(
+            {cache_key(granularity, p): computed[p] for p in missing if p in closed},
+            timeout=None
+        )
+    
+    return [dict(results[p], period=p.isoformat()) for p in periods]
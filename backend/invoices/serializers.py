@@ -2,14 +2,25 @@ from rest_framework import serializers
 from .models import Invoice, Session, PageEvent
 
 class InvoiceSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Invoice model
+    Pass `fields` (iterable of field names) to serialize only a subset of fields
+    """
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
     created_by = serializers.PrimaryKeyRelatedField(read_only=True)
     
     class Meta:
         model = Invoice
         fields = ['id', 'invoice_no', 'client_name', 'amount', 'date', 'status', 
-                  'description', 'is_done', 'created_by', 'created_by_username']
+                  'description', 'is_done', 'created_by', 'created_by_username', 'updated_at']
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
         
+
 class SessionSerializer(serializers.ModelSerializer):
     """
     Serializer for Session model
@@ -27,6 +38,8 @@ class PageEventSerializer(serializers.ModelSerializer):
     Serializer for PageEvent model
     Converts PageEvent objects to/from JSON for API
     """
+    page = serializers.CharField(source='page.path', read_only=True)  # Normalized page path
+    
     class Meta:
         model = PageEvent
         fields = ['id', 'session', 'user', 'page', 'start_time', 'end_time', 'duration']
@@ -0,0 +1,67 @@
+"""
+Signal handlers for the invoices app
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ChangeSequence, Invoice, InvoiceTombstone
+from .reports import invalidate_date
+from .sync import notifier
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_previous_date(sender, instance, **kwargs):
+    """Keep the stored date so a moved invoice also invalidates its old report period"""
+    instance._previous_date = None
+    if instance.pk and not kwargs.get('raw'):
+        # Loaded from the database - the stored date is known, no need to query it
+        instance._previous_date = getattr(instance, '_stored_date', None)
+        if instance._previous_date is None:
+            instance._previous_date = (
+                Invoice.objects.filter(pk=instance.pk).values_list('date', flat=True).first()
+            )
+
+
+@receiver(post_save, sender=Invoice)
+def invalidate_report_on_save(sender, instance, using, **kwargs):
+    """Drop cached report periods touched by a created or updated invoice"""
+    # After commit - a report computed before it would cache the old rows again
+    transaction.on_commit(partial(invalidate_date, instance.date), using=using)
+    previous_date = getattr(instance, '_previous_date', None)
+    if previous_date and previous_date != instance.date:
+        transaction.on_commit(partial(invalidate_date, previous_date), using=using)
+    instance._stored_date = instance.date
+
+
+@receiver(post_delete, sender=Invoice)
+def invalidate_report_on_delete(sender, instance, using, **kwargs):
+    """Drop cached report periods of a deleted invoice"""
+    transaction.on_commit(partial(invalidate_date, instance.date), using=using)
+
+
+@receiver(post_save, sender=Invoice)
+def notify_change_on_save(sender, instance, using, **kwargs):
+    """Wake up change streams once the saved invoice is visible"""
+    transaction.on_commit(notifier.notify, using=using)
+
+
+@receiver(post_delete, sender=Invoice)
+def record_tombstone_on_delete(sender, instance, using, **kwargs):
+    """Leave a tombstone in the change feed so synced clients drop the invoice"""
+    with transaction.atomic(using=using):
+        tombstone = InvoiceTombstone(
+            invoice_id=instance.pk,
+            change_seq=ChangeSequence.objects.advance(Invoice.CHANGE_SEQUENCE, using=using),
+            deleted_at=timezone.now(),
+        )
+        InvoiceTombstone.objects.using(using).bulk_create(
+            [tombstone],
+            update_conflicts=True,
+            unique_fields=['invoice_id'],
+            update_fields=['change_seq', 'deleted_at'],
+        )
+    transaction.on_commit(notifier.notify, using=using)
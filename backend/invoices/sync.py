@@ -0,0 +1,150 @@
+"""
+Invoice change feed for delta sync
+
+Every saved invoice takes the next number of the invoice ChangeSequence counter
+(Invoice.change_seq), and every deleted invoice leaves an InvoiceTombstone with its
+own number. A client keeps the cursor (the last number it has seen) and asks only
+for what changed after it:
+- changes_since() returns one page of changed invoices and deleted ids
+- stream_changes() pushes the same pages as Server-Sent Events while the connection is open
+
+Saves and deletes notify streams of this process right after commit, streams served
+by other processes notice changes by polling the counter.
+"""
+import json
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from .models import ChangeSequence, Invoice, InvoiceTombstone
+
+PAGE_SIZE = getattr(settings, 'SYNC_PAGE_SIZE', 500)  # Default and maximum number of changes per page
+STREAM_TIMEOUT = getattr(settings, 'SYNC_STREAM_TIMEOUT', 300)  # Seconds before a stream ends (clients reconnect)
+STREAM_POLL_INTERVAL = getattr(settings, 'SYNC_STREAM_POLL_INTERVAL', 1.0)  # Seconds between counter checks
+STREAM_HEARTBEAT = getattr(settings, 'SYNC_STREAM_HEARTBEAT', 15)  # Seconds between keep-alive comments
+STREAM_RETRY_MS = 3000  # Reconnect delay suggested to EventSource clients
+
+
+class ChangeNotifier:
+    """Wakes up the streams of this process when an invoice change is committed"""
+    def __init__(self):
+        self.version = 0
+        self._condition = threading.Condition()
+
+    def notify(self):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version, timeout):
+        """Wait until notified after `version` was read, or timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.version != version, timeout)
+
+
+notifier = ChangeNotifier()
+
+
+class EventStreamRenderer(BaseRenderer):
+    """text/event-stream renderer, used for error responses of the change stream"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data)
+
+
+def format_event(event, data, event_id=None):
+    """A Server-Sent Event with a JSON payload"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"), default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_cursor(value):
+    """Cursor from a query param or Last-Event-ID header, None if invalid"""
+    if value in (None, ''):
+        return 0
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor >= 0 else None
+
+
+def changes_since(queryset, cursor, limit=PAGE_SIZE):
+    """
+    One page of changes after cursor, in sequence order
+
+    queryset - the invoices to sync (change_seq must be loaded)
+    Returns (invoices, deleted_ids, next_cursor, has_more). A cursor of 0 is a full
+    sync, which skips tombstones since the client has nothing to delete.
+    """
+    invoices = list(queryset.filter(change_seq__gt=cursor).order_by('change_seq')[:limit + 1])
+    tombstones = []
+    if cursor:
+        tombstones = list(
+            InvoiceTombstone.objects.filter(change_seq__gt=cursor)
+            .order_by('change_seq')
+            .values_list('change_seq', 'invoice_id')[:limit + 1]
+        )
+
+    # Merge both by sequence number and keep the first `limit` changes
+    changes = sorted(
+        [(invoice.change_seq, invoice) for invoice in invoices] + [(seq, None) for seq, _ in tombstones],
+        key=lambda change: change[0],
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if not changes:
+        return [], [], cursor, False
+
+    next_cursor = changes[-1][0]
+    return (
+        [invoice for seq, invoice in changes if invoice is not None],
+        [invoice_id for seq, invoice_id in tombstones if seq <= next_cursor],
+        next_cursor,
+        has_more,
+    )
+
+
+def stream_changes(fetch_page, cursor, timeout=STREAM_TIMEOUT):
+    """
+    Generator of Server-Sent Events with the changes after cursor
+
+    fetch_page(cursor) - returns the payload of one page of changes (dict with
+    changed, deleted, cursor and has_more). Each page is sent as a "changes" event
+    with the new cursor as its id, so a reconnecting EventSource resumes from
+    Last-Event-ID. The stream ends after timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    last_sent = time.monotonic()
+    seen_counter = None
+    yield f'retry: {STREAM_RETRY_MS}\n\n'
+
+    while True:
+        version = notifier.version
+        # One single-row read per poll, the feed is only queried when the counter moved
+        counter = ChangeSequence.objects.current(Invoice.CHANGE_SEQUENCE)
+        if counter != seen_counter:
+            page = fetch_page(cursor)
+            if page['changed'] or page['deleted']:
+                cursor = page['cursor']
+                last_sent = time.monotonic()
+                yield format_event('changes', page, event_id=cursor)
+            if page['has_more']:
+                continue
+            seen_counter = counter
+
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_sent >= STREAM_HEARTBEAT:
+            last_sent = now
+            yield ': keep-alive\n\n'
+        notifier.wait(version, min(STREAM_POLL_INTERVAL, deadline - now))
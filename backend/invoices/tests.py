@@ -1,3 +1,1161 @@
-from django.test import TestCase
+import gzip
+import json
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .dedup import recent_event_ids
+from .models import BeaconReceipt, ChangeSequence, Invoice, Page, PageEvent, Session
+from .open_events import open_page_events
+from .pages import MAX_PATH_LENGTH, get_page, normalize_page_path, page_cache
+from .partitions import drop_partition, list_partitions, month_key, partition_model
+from .sync import stream_changes
+from .throttling import TokenBucketThrottle, buckets, pending_writes
+
+
+# Tracking tests send fixed times (2026-01-01), far from the server clock
+fixed_tracking_times = override_settings(TRACKING_MAX_CLOCK_SKEW=None)
+
+
+def reset_tracking_state():
+    """Clear the per-process tracking caches so tests don't leak state"""
+    buckets.clear()
+    recent_event_ids.clear()
+    open_page_events.clear()
+    page_cache.clear()
+
+
+@fixed_tracking_times
+@mock.patch.dict(TokenBucketThrottle.THROTTLE_RATES, {'tracking_start': '30/min', 'tracking_end': '30/min'})
+class TrackingRateLimitTests(TestCase):
+    """Token-bucket throttling and load shedding on the track/* endpoints"""
+
+    def setUp(self):
+        reset_tracking_state()
+        self.abuser = User.objects.create_user('abuser')
+        self.abuser_client = self.client_for(self.abuser, 'abuser-session')
+        self.users = [User.objects.create_user(f'user{i}') for i in range(5)]
+        self.user_clients = [self.client_for(user, f'session-{user.pk}') for user in self.users]
+
+    def client_for(self, user, session_id):
+        # A real JWT - authentication must not query the database before throttling
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        client.session_id = session_id
+        client.post('/api/track/session/start', {
+            'session_id': session_id,
+            'start_time': '2026-01-01T00:00:00Z',
+        }, format='json')
+        return client
+
+    def visit(self, client, page):
+        """Start and end a page event, returns the two responses"""
+        start = client.post('/api/track/event/start', {
+            'session_id': client.session_id,
+            'page': page,
+            'start_time': '2026-01-01T00:00:05Z',
+        }, format='json')
+        end = client.post('/api/track/event/end', {
+            'session_id': client.session_id,
+            'page': page,
+            'end_time': '2026-01-01T00:00:10Z',
+        }, format='json')
+        return start, end
+
+    def test_burst_is_rejected_with_retry_after(self):
+        for _ in range(30):
+            response = self.abuser_client.post('/api/track/event/start', {
+                'session_id': self.abuser_client.session_id,
+                'page': '/login',
+                'start_time': '2026-01-01T00:00:05Z',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.abuser_client.post('/api/track/event/start', {
+                'session_id': self.abuser_client.session_id,
+                'page': '/login',
+                'start_time': '2026-01-01T00:00:05Z',
+            }, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(len(queries), 0)
+
+    def test_buckets_are_per_user_and_endpoint_class(self):
+        for _ in range(40):
+            self.abuser_client.post('/api/track/event/start', {
+                'session_id': self.abuser_client.session_id,
+                'page': '/login',
+                'start_time': '2026-01-01T00:00:05Z',
+            }, format='json')
+
+        # Same user, end endpoints have their own bucket
+        response = self.abuser_client.post('/api/track/event/end', {
+            'session_id': self.abuser_client.session_id,
+            'page': '/login',
+            'end_time': '2026-01-01T00:00:10Z',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Other users are unaffected
+        start, end = self.visit(self.user_clients[0], '/dashboard')
+        self.assertEqual(start.status_code, 201)
+        self.assertEqual(end.status_code, 200)
+
+    def test_flood_is_cut_off_at_the_bucket_size(self):
+        # Frozen clock and a full bucket - no tokens are refilled during the flood
+        buckets.clear()
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: 1000.0):
+            statuses = [
+                self.abuser_client.post('/api/track/event/start', {
+                    'session_id': self.abuser_client.session_id,
+                    'page': '/login',
+                    'start_time': '2026-01-01T00:00:05Z',
+                }, format='json').status_code
+                for _ in range(50)
+            ]
+        self.assertEqual(statuses, [201] * 30 + [429] * 20)
+        self.assertEqual(PageEvent.objects.filter(user=self.abuser).count(), 30)
+
+    def test_page_event_starts_are_dropped_when_writes_are_saturated(self):
+        client = self.user_clients[0]
+        self.assertEqual(client.post('/api/track/event/start', {
+            'session_id': client.session_id, 'page': '/dashboard', 'start_time': '2026-01-01T00:00:05Z',
+        }, format='json').status_code, 201)
+
+        with mock.patch.object(pending_writes, 'count', 8):
+            start = client.post('/api/track/event/start', {
+                'session_id': client.session_id, 'page': '/login', 'start_time': '2026-01-01T00:00:20Z',
+            }, format='json')
+            end = client.post('/api/track/event/end', {
+                'session_id': client.session_id, 'page': '/dashboard', 'end_time': '2026-01-01T00:00:20Z',
+            }, format='json')
+            session_end = client.post('/api/track/session/end', {
+                'session_id': client.session_id, 'end_time': '2026-01-01T00:01:00Z',
+            }, format='json')
+
+        self.assertEqual(start.status_code, 202)
+        self.assertEqual(start.data, {'dropped': True})
+        # Page exits are never dropped - the event would stay open until session_end with a wrong duration
+        self.assertEqual(end.status_code, 200)
+        event = PageEvent.objects.get(user=self.users[0])
+        self.assertEqual((event.page.path, event.duration), ('/dashboard', 15))
+        # Session requests are never dropped
+        self.assertEqual(session_end.status_code, 200)
+        self.assertIsNotNone(Session.objects.get(user=self.users[0]).end_time)
+
+
+# Data sizes the query budgets are checked at, as multiples of the base fixture size
+SCALES = (1, 10)
+
+# Maximum queries per admin changelist, keyed by model label - add one when registering a model
+ADMIN_CHANGELIST_BUDGETS = {
+    'auth.group': 5,
+    'auth.user': 6,
+    'invoices.invoice': 8,
+    'invoices.page': 5,
+    'invoices.pageevent': 9,
+    'invoices.session': 8,
+}
+
+
+def data_queries(captured, transactions=False):
+    """
+    SQL of the captured queries, minus the savepoints TestCase adds around atomic blocks
+    With transactions, each atomic block the request opens counts as one statement (its
+    SAVEPOINT here, BEGIN or SAVEPOINT outside of TestCase), only the releases are skipped.
+    """
+    skipped = ('RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT') if transactions else ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+    return [query['sql'] for query in captured if not query['sql'].startswith(skipped)]
+
+
+@fixed_tracking_times
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetTests(TestCase):
+    """
+    Query budgets for every route in invoices/urls.py and core/urls.py, and the admin changelists
+
+    Each request is sent with generated fixture data at every scale in SCALES. It fails
+    when the request issues more queries than its budget, or when its query count
+    grows with the number of rows (an N+1 pattern).
+    """
+
+    def setUp(self):
+        reset_tracking_state()
+        self.user = User.objects.create_user('budget', password='secret', is_staff=True, is_superuser=True)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.client.force_login(self.user)
+        self.fixture_seed = 0
+        self.session_count = 0
+
+    def generate(self, scale):
+        """Add realistic fixture data, `scale` times the base size"""
+        self.fixture_seed += 1
+        call_command(
+            'generate_fixtures', users=3 * scale, invoices=10 * scale, sessions=5 * scale,
+            page_events=20 * scale, days=60, seed=self.fixture_seed, stdout=StringIO(),
+        )
+
+    def open_session(self, open_events=0):
+        """A session of the test user with `open_events` page events not ended yet"""
+        self.session_count += 1
+        session = Session.objects.create(
+            session_id=f'budget-{self.session_count}', user=self.user, start_time='2026-01-01T00:00:00Z',
+        )
+        PageEvent.objects.bulk_create([
+            PageEvent(session=session, user=self.user, page=get_page(f'/page-{i}'), start_time='2026-01-01T00:00:05Z')
+            for i in range(open_events)
+        ])
+        return session
+
+    def invoice_payload(self, **fields):
+        return {
+            'invoice_no': 'INV-BUDGET', 'client_name': 'Budget Sdn Bhd', 'amount': '100.00',
+            'date': '2026-01-15', 'status': 'Unpaid', **fields,
+        }
+
+    def assertQueryBudget(self, budget, make_request, status_code=200, transactions=False):
+        """
+        Check the queries of a request at every data scale
+
+        make_request(scale) - adds the rows the request reads and returns a function
+        sending the request. Only queries made by that function are counted, and the
+        transactions it opens too with transactions=True (see data_queries).
+        """
+        counts = {}
+        for scale in SCALES:
+            self.generate(scale)
+            reset_tracking_state()
+            cache.clear()
+            send = make_request(scale)
+            with CaptureQueriesContext(connection) as captured:
+                response = send()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, status_code, getattr(response, 'data', None))
+
+            queries = data_queries(captured, transactions)
+            counts[scale] = len(queries)
+            self.assertLessEqual(
+                len(queries), budget,
+                f'{len(queries)} queries at scale {scale}, budget is {budget}:\n' + '\n'.join(queries),
+            )
+        self.assertEqual(len(set(counts.values())), 1, f'Query count grows with the number of rows: {counts}')
+
+    # ---- core/urls.py ----
+
+    def test_token_obtain(self):
+        self.assertQueryBudget(1, lambda scale: partial(
+            self.client.post, '/api/token/', {'username': 'budget', 'password': 'secret'},
+        ))
+
+    def test_token_refresh(self):
+        self.assertQueryBudget(1, lambda scale: partial(
+            self.client.post, '/api/token/refresh/', {'refresh': str(RefreshToken.for_user(self.user))},
+        ))
+
+    def test_admin_index(self):
+        self.assertQueryBudget(3, lambda scale: partial(self.client.get, reverse('admin:index')))
+
+    def test_admin_changelists(self):
+        for model, model_admin in admin.site._registry.items():
+            label = model._meta.label_lower
+            with self.subTest(model=label):
+                self.assertIn(label, ADMIN_CHANGELIST_BUDGETS, f'Add a query budget for the {label} changelist')
+                url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+                self.assertQueryBudget(ADMIN_CHANGELIST_BUDGETS[label], lambda scale: partial(self.client.get, url))
+
+    def test_admin_invoice_toggle_done(self):
+        def make_request(scale):
+            invoice = Invoice.objects.latest('id')
+            return partial(self.client.get, reverse('admin:invoices_invoice_toggle_done', args=[invoice.id]))
+        self.assertQueryBudget(5, make_request, status_code=302)
+
+    # ---- invoices/urls.py - invoices ----
+
+    def test_api_root(self):
+        self.assertQueryBudget(1, lambda scale: partial(self.api.get, '/api/'))
+
+    def test_invoice_list(self):
+        self.assertQueryBudget(2, lambda scale: partial(self.api.get, '/api/invoices/'))
+
+    def test_invoice_list_sparse_fields(self):
+        self.assertQueryBudget(2, lambda scale: partial(self.api.get, '/api/invoices/?fields=id,amount,status'))
+
+    def test_invoice_create(self):
+        self.assertQueryBudget(3, lambda scale: partial(
+            self.api.post, '/api/invoices/', self.invoice_payload(), format='json',
+        ), status_code=201)
+
+    def test_invoice_retrieve(self):
+        def make_request(scale):
+            return partial(self.api.get, f"/api/invoices/{Invoice.objects.latest('id').id}/")
+        self.assertQueryBudget(2, make_request)
+
+    def test_invoice_update(self):
+        def make_request(scale):
+            invoice = Invoice.objects.latest('id')
+            return partial(self.api.put, f'/api/invoices/{invoice.id}/', self.invoice_payload(date='2025-06-01'), format='json')
+        self.assertQueryBudget(4, make_request)
+
+    def test_invoice_partial_update(self):
+        def make_request(scale):
+            invoice = Invoice.objects.latest('id')
+            return partial(self.api.patch, f'/api/invoices/{invoice.id}/', {'is_done': True}, format='json')
+        self.assertQueryBudget(4, make_request)
+
+    def test_invoice_delete(self):
+        def make_request(scale):
+            return partial(self.api.delete, f"/api/invoices/{Invoice.objects.latest('id').id}/")
+        self.assertQueryBudget(5, make_request, status_code=204)
+
+    def test_invoice_report(self):
+        self.assertQueryBudget(3, lambda scale: partial(
+            self.api.get, '/api/invoices/report/?granularity=week&start=2025-01-01',
+        ))
+
+    def test_invoice_changes(self):
+        self.assertQueryBudget(2, lambda scale: partial(self.api.get, '/api/invoices/changes/'))
+
+    def test_invoice_changes_since_cursor(self):
+        def make_request(scale):
+            cursor = ChangeSequence.objects.current(Invoice.CHANGE_SEQUENCE)
+            for invoice in Invoice.objects.order_by('id')[:scale]:
+                invoice.save()
+            Invoice.objects.filter(id__in=Invoice.objects.order_by('-id').values('id')[:scale]).delete()
+            return partial(self.api.get, f'/api/invoices/changes/?since={cursor}')
+        self.assertQueryBudget(3, make_request)
+
+    def test_invoice_changes_stream(self):
+        def make_request(scale):
+            cursor = ChangeSequence.objects.current(Invoice.CHANGE_SEQUENCE)
+            for invoice in Invoice.objects.order_by('id')[:scale]:
+                invoice.save()
+            return partial(self.api.get, '/api/invoices/changes/stream/', HTTP_LAST_EVENT_ID=str(cursor))
+
+        # Send one page of changes, then end the stream
+        with mock.patch('invoices.views.stream_changes', partial(stream_changes, timeout=0)):
+            self.assertQueryBudget(4, make_request)
+
+    # ---- invoices/urls.py - tracking ----
+    # Tracking views authenticate from the token claims, a header token never loads the user
+
+    def test_session_start(self):
+        self.assertQueryBudget(1, lambda scale: partial(self.api.post, '/api/track/session/start', {
+            'session_id': f'budget-new-{scale}', 'start_time': '2026-01-01T00:00:00Z',
+        }, format='json'), status_code=201)
+
+    def test_event_start(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(self.api.post, '/api/track/event/start', {
+                'session_id': session.session_id, 'page': '/dashboard', 'start_time': '2026-01-01T00:00:05Z',
+            }, format='json')
+        self.assertQueryBudget(3, make_request, status_code=201)
+
+    def test_event_end(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            self.api.post('/api/track/event/start', {
+                'session_id': session.session_id, 'page': '/dashboard', 'start_time': '2026-01-01T00:00:05Z',
+            }, format='json')
+            return partial(self.api.post, '/api/track/event/end', {
+                'session_id': session.session_id, 'page': '/dashboard', 'end_time': '2026-01-01T00:00:10Z',
+            }, format='json')
+        self.assertQueryBudget(1, make_request)
+
+    def test_event_end_beacon_without_open_event_cache(self):
+        """Events started by another process - the token is in the body and the event is looked up"""
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(APIClient().post, '/api/track/event/end', {
+                'session_id': session.session_id, 'page': '/page-0', 'end_time': '2026-01-01T00:00:10Z',
+                'token': str(AccessToken.for_user(self.user)),
+            }, format='json')
+        self.assertQueryBudget(4, make_request)
+
+    def test_session_end(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(self.api.post, '/api/track/session/end', {
+                'session_id': session.session_id, 'end_time': '2026-01-01T00:10:00Z',
+            }, format='json')
+        self.assertQueryBudget(4, make_request)
+
+    def test_session_end_beacon(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(APIClient().post, '/api/track/session/end', {
+                'session_id': session.session_id, 'end_time': '2026-01-01T00:10:00Z',
+                'token': str(AccessToken.for_user(self.user)),
+            }, format='json')
+        self.assertQueryBudget(5, make_request)
+
+
+    # ---- Beacons with an event_id: the receipt INSERT and its transaction ----
+
+    def test_event_end_with_event_id(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            self.api.post('/api/track/event/start', {
+                'session_id': session.session_id, 'page': '/dashboard', 'start_time': '2026-01-01T00:00:05Z',
+            }, format='json')
+            return partial(self.api.post, '/api/track/event/end', {
+                'session_id': session.session_id, 'page': '/dashboard', 'end_time': '2026-01-01T00:00:10Z',
+                'event_id': f'event-end-{scale}',
+            }, format='json')
+        self.assertQueryBudget(3, make_request, transactions=True)
+
+    def test_event_end_beacon_with_event_id(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(APIClient().post, '/api/track/event/end', {
+                'session_id': session.session_id, 'page': '/page-0', 'end_time': '2026-01-01T00:00:10Z',
+                'event_id': f'event-end-beacon-{scale}', 'token': str(AccessToken.for_user(self.user)),
+            }, format='json')
+        self.assertQueryBudget(6, make_request, transactions=True)
+
+    def test_session_end_with_event_id(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(self.api.post, '/api/track/session/end', {
+                'session_id': session.session_id, 'end_time': '2026-01-01T00:10:00Z',
+                'event_id': f'session-end-{scale}',
+            }, format='json')
+        self.assertQueryBudget(6, make_request, transactions=True)
+
+    def test_session_end_beacon_with_event_id(self):
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            return partial(APIClient().post, '/api/track/session/end', {
+                'session_id': session.session_id, 'end_time': '2026-01-01T00:10:00Z',
+                'event_id': f'session-end-beacon-{scale}', 'token': str(AccessToken.for_user(self.user)),
+            }, format='json')
+        self.assertQueryBudget(7, make_request, transactions=True)
+
+    def test_duplicate_beacon_after_a_restart(self):
+        """The in-memory filter is empty - the receipt INSERT finds the id, the view doesn't run"""
+        def make_request(scale):
+            session = self.open_session(open_events=scale)
+            BeaconReceipt.objects.create(user_id=self.user.id, event_id=f'duplicate-{scale}')
+            return partial(APIClient().post, '/api/track/session/end', {
+                'session_id': session.session_id, 'end_time': '2026-01-01T00:10:00Z',
+                'event_id': f'duplicate-{scale}', 'token': str(AccessToken.for_user(self.user)),
+            }, format='json')
+        self.assertQueryBudget(2, make_request, transactions=True)
+
+
+class PageEventPartitionTests(TestCase):
+    """Monthly page event partitions behind the invoices_pageevent view"""
+
+    def setUp(self):
+        reset_tracking_state()
+        self.user = User.objects.create_user('tracked')
+        self.session = Session.objects.create(
+            session_id='partitioned', user=self.user, start_time=datetime(2026, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        self.page = get_page('/dashboard')
+
+    def event(self, year, month, day=15):
+        return PageEvent(
+            session=self.session, user=self.user, page=self.page,
+            start_time=datetime(year, month, day, tzinfo=dt_timezone.utc),
+        )
+
+    def test_events_are_written_to_the_partition_of_their_month(self):
+        self.event(2026, 1).save()
+        PageEvent.objects.bulk_create([self.event(2026, 2), self.event(2026, 2), self.event(2026, 3)])
+
+        self.assertEqual(list_partitions()[0], ['202601', '202602', '202603'])
+        self.assertEqual(partition_model('202602').objects.count(), 2)
+        self.assertEqual(PageEvent.objects.count(), 4)
+        # Ids are unique across partitions
+        self.assertEqual(len(set(PageEvent.objects.values_list('id', flat=True))), 4)
+
+    def test_between_reads_only_the_partitions_of_the_range(self):
+        PageEvent.objects.bulk_create([self.event(2026, month) for month in (1, 2, 3)])
+        start, end = datetime(2026, 2, 1, tzinfo=dt_timezone.utc), datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+        with CaptureQueriesContext(connection) as queries:
+            events = list(PageEvent.objects.between(start, end))
+        self.assertEqual([event.start_time.month for event in events], [2])
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('invoices_pageevent_202602', sql)
+        self.assertNotIn('invoices_pageevent_202601', sql)
+        self.assertNotIn('invoices_pageevent_202603', sql)
+
+    def test_updates_and_cascading_deletes_span_partitions(self):
+        PageEvent.objects.bulk_create([self.event(2026, 1), self.event(2026, 2)])
+        self.assertEqual(PageEvent.objects.filter(end_time__isnull=True).update(duration=7), 2)
+        self.assertEqual(set(PageEvent.objects.values_list('duration', flat=True)), {7})
+
+        self.session.delete()
+        self.assertFalse(PageEvent.objects.exists())
+
+    def test_detach_attach_and_drop_old_months(self):
+        PageEvent.objects.bulk_create([self.event(2026, 1), self.event(2026, 2)])
+
+        call_command('page_event_partitions', 'detach', before='2026-02', stdout=StringIO())
+        self.assertEqual(list_partitions(), (['202602'], ['202601']))
+        self.assertEqual(PageEvent.objects.count(), 1)
+
+        call_command('page_event_partitions', 'attach', '2026-01', stdout=StringIO())
+        self.assertEqual(PageEvent.objects.count(), 2)
+
+        call_command('page_event_partitions', 'drop', '2026-01', stdout=StringIO())
+        self.assertEqual(list_partitions(), (['202602'], []))
+        self.assertEqual(PageEvent.objects.count(), 1)
+
+    def start_event(self, start_time, page='/dashboard'):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        return api, api.post('/api/track/event/start', {
+            'session_id': self.session.session_id, 'page': page, 'start_time': start_time.isoformat(),
+        }, format='json')
+
+    @override_settings(TRACKING_MAX_CLOCK_SKEW=3600)
+    def test_event_start_times_far_from_the_server_clock_are_rejected(self):
+        for start_time in (timezone.now() - timedelta(days=400), timezone.now() + timedelta(days=40)):
+            with self.subTest(start_time=start_time):
+                _, response = self.start_event(start_time)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('start_time', response.data)
+        # No partition was created for the far-off months
+        self.assertEqual(list_partitions(), ([], []))
+
+        _, response = self.start_event(timezone.now() - timedelta(minutes=5))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list_partitions()[0], [month_key(timezone.now() - timedelta(minutes=5))])
+
+    def test_late_events_of_a_detached_month_are_rejected(self):
+        started = timezone.now() - timedelta(minutes=5)
+        api, response = self.start_event(started)
+        self.assertEqual(response.status_code, 201)
+        key = month_key(started)
+        call_command('page_event_partitions', 'detach', key, stdout=StringIO())
+
+        # A late start of the month isn't written, nor is the partition recreated
+        _, response = self.start_event(started, page='/login')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(list_partitions(), ([], [key]))
+
+        # Ending the event started before the month was detached, inside the event_id transaction
+        response = api.post('/api/track/event/end', {
+            'session_id': self.session.session_id, 'page': '/dashboard', 'end_time': timezone.now().isoformat(),
+            'event_id': 'late-end',
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(BeaconReceipt.objects.exists())
+
+
+@fixed_tracking_times
+class BeaconDeduplicationTests(TestCase):
+    """Duplicate tracking beacons are dropped by their per-user event_id"""
+
+    def setUp(self):
+        reset_tracking_state()
+        self.user = User.objects.create_user('beacon')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def start_event(self, api, event_id, page='/dashboard', session_id='dedup-session'):
+        return api.post('/api/track/event/start', {
+            'session_id': session_id, 'page': page, 'start_time': '2026-01-01T00:00:05Z', 'event_id': event_id,
+        }, format='json')
+
+    def test_duplicate_is_answered_from_memory(self):
+        self.assertEqual(self.start_event(self.api, 'event-1').status_code, 201)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.start_event(self.api, 'event-1')
+        self.assertEqual(response.data, {'duplicate': True, 'event_id': 'event-1'})
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(PageEvent.objects.count(), 1)
+
+    def test_duplicate_is_detected_in_the_database_after_a_restart(self):
+        self.assertEqual(self.start_event(self.api, 'event-1').status_code, 201)
+        reset_tracking_state()
+
+        response = self.start_event(self.api, 'event-1')
+        self.assertEqual(response.data, {'duplicate': True, 'event_id': 'event-1'})
+        self.assertEqual(PageEvent.objects.count(), 1)
+
+    def test_error_response_does_not_consume_the_event_id(self):
+        response = self.start_event(self.api, 'event-1', page='/' + 'x' * 300)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BeaconReceipt.objects.exists())
+
+        self.assertEqual(self.start_event(self.api, 'event-1').status_code, 201)
+
+    def test_event_ids_are_scoped_per_user(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other'))
+        self.assertEqual(self.start_event(self.api, 'event-1').status_code, 201)
+
+        # Another user reusing the id is processed, and a token in the body is scoped the same way
+        self.assertEqual(self.start_event(other, 'event-1', session_id='other-session').status_code, 201)
+        response = APIClient().post('/api/track/session/end', {
+            'session_id': 'dedup-session', 'end_time': '2026-01-01T00:10:00Z', 'event_id': 'event-1',
+            'token': str(AccessToken.for_user(self.user)),
+        }, format='json')
+        self.assertTrue(response.data['duplicate'])
+        self.assertEqual(BeaconReceipt.objects.count(), 2)
+
+    def test_old_receipts_are_pruned(self):
+        self.start_event(self.api, 'old')
+        self.start_event(self.api, 'recent')
+        BeaconReceipt.objects.filter(event_id='old').update(received_at=timezone.now() - timedelta(days=8))
+
+        call_command('prune_beacon_receipts', days=7, stdout=StringIO())
+        self.assertEqual(list(BeaconReceipt.objects.values_list('event_id', flat=True)), ['recent'])
+
+
+class InvoiceReportTests(TestCase):
+    """Report totals, cached closed periods and their invalidation"""
+
+    url = '/api/invoices/report/?granularity=month&start=2025-01-01&end=2025-12-31'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reporter')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.january = self.invoice('2025-01-10', '100.00', 'Paid')
+        self.invoice('2025-01-20', '50.00', 'Unpaid')
+        self.invoice('2025-03-05', '30.00', 'Paid')
+
+    def invoice(self, date, amount, status):
+        return Invoice.objects.create(
+            invoice_no='INV-REPORT', client_name='Report Sdn Bhd', amount=amount, date=date,
+            status=status, created_by=self.user,
+        )
+
+    def series(self):
+        response = self.api.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return {period['period']: period for period in response.data['series']}
+
+    def test_totals_per_period_status_and_creator(self):
+        series = self.series()
+        self.assertEqual(len(series), 12)
+        self.assertEqual(series['2025-01-01']['total'], '150.00')
+        self.assertEqual(series['2025-01-01']['count'], 2)
+        self.assertEqual(series['2025-01-01']['by_status'], {
+            'Paid': {'total': '100.00', 'count': 1}, 'Unpaid': {'total': '50.00', 'count': 1},
+        })
+        self.assertEqual(series['2025-01-01']['by_creator'], {str(self.user.id): {'total': '150.00', 'count': 2}})
+        self.assertEqual(series['2025-02-01']['total'], '0.00')
+        self.assertEqual(series['2025-03-01']['total'], '30.00')
+
+    def test_closed_periods_are_served_from_cache(self):
+        self.series()
+        # Bypasses save() and its signals, so cached periods keep the old total
+        Invoice.objects.update(amount='1.00')
+
+        with self.assertNumQueries(1):  # Creator names only
+            series = self.series()
+        self.assertEqual(series['2025-01-01']['total'], '150.00')
+
+    def test_moving_an_invoice_invalidates_both_periods(self):
+        self.series()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.january.date = '2025-03-15'
+            self.january.save()
+
+        series = self.series()
+        self.assertEqual(series['2025-01-01']['total'], '50.00')
+        self.assertEqual(series['2025-03-01']['total'], '130.00')
+
+    def test_malformed_dates_are_rejected(self):
+        for query in ('start=2025/01/01', 'end=abc', 'start=2025-02-30', 'start=2025-03-01&end=2025-01-01'):
+            with self.subTest(query=query):
+                self.assertEqual(self.api.get(f'/api/invoices/report/?{query}').status_code, 400)
+
+    def test_only_missing_periods_are_queried(self):
+        self.series()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice('2025-12-01', '10.00', 'Paid')
+            self.january.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            series = self.series()
+        self.assertEqual(series['2025-12-01']['total'], '10.00')
+        report_sql = next(query['sql'] for query in queries if 'SUM' in query['sql'])
+        # January and December only, not the months between them
+        self.assertIn('2025-02-01', report_sql)
+        self.assertIn('2025-12-01', report_sql)
+        self.assertNotIn('2025-06-01', report_sql)
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= trims responses, writes are still validated and saved with every field"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('sparse')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.invoice = Invoice.objects.create(
+            invoice_no='INV-SPARSE', client_name='Sparse Sdn Bhd', amount='10.00', date='2025-01-10',
+            status='Paid', created_by=self.user,
+        )
+
+    def payload(self, **fields):
+        return {
+            'invoice_no': 'INV-NEW', 'client_name': 'New Sdn Bhd', 'amount': '20.00',
+            'date': '2025-02-01', 'status': 'Unpaid', **fields,
+        }
+
+    def test_list_returns_only_requested_fields(self):
+        response = self.api.get('/api/invoices/?fields=id,amount')
+        self.assertEqual(response.data, [{'id': self.invoice.id, 'amount': '10.00'}])
+
+    def test_partial_update_saves_fields_not_requested(self):
+        response = self.api.patch(f'/api/invoices/{self.invoice.id}/?fields=id', {'status': 'Unpaid'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': self.invoice.id})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, 'Unpaid')
+
+    def test_update_validates_every_required_field(self):
+        response = self.api.put(f'/api/invoices/{self.invoice.id}/?fields=id,status', {'status': 'Unpaid'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('invoice_no', response.data)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, 'Paid')
+
+    def test_create_saves_every_field(self):
+        response = self.api.post('/api/invoices/?fields=id', self.payload(), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(response.data), ['id'])
+        self.assertEqual(Invoice.objects.get(id=response.data['id']).client_name, 'New Sdn Bhd')
+
+        response = self.api.post('/api/invoices/?fields=id', {'status': 'Unpaid'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.data)
+
+
+class TrackingParserTests(TestCase):
+    """gzip-compressed JSON and compact beacon bodies on the tracking endpoints"""
+
+    url = '/api/track/session/start'
+
+    def setUp(self):
+        reset_tracking_state()
+        self.user = User.objects.create_user('parser')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def post(self, body, content_type, **headers):
+        return self.api.generic('POST', self.url, body, content_type=content_type, **headers)
+
+    def test_gzip_json_body(self):
+        body = gzip.compress(json.dumps({'session_id': 'gzip', 'start_time': '2026-01-01T00:00:00Z'}).encode())
+        response = self.post(body, 'application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Session.objects.get(session_id='gzip').start_time, datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+
+    def test_compact_beacon(self):
+        for session_id, compress in (('beacon', False), ('gzip-beacon', True)):
+            with self.subTest(compress=compress):
+                body = json.dumps([session_id, 1767225600000]).encode()
+                response = self.post(gzip.compress(body) if compress else body, 'application/x-beacon')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(
+                    Session.objects.get(session_id=session_id).start_time,
+                    datetime(2026, 1, 1, tzinfo=dt_timezone.utc),
+                )
+
+    def test_decompressed_size_is_limited(self):
+        body = gzip.compress(b'[' + b' ' * (64 * 1024) + b'"too-big"]')
+        response = self.post(body, 'application/x-beacon')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Session.objects.exists())
+
+    def test_corrupt_gzip_is_rejected(self):
+        response = self.post(b'\x1f\x8b' + b'not gzip at all', 'application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 400)
+
+    def test_out_of_range_epoch(self):
+        response = self.post(b'["far-future", 1e20]', 'application/x-beacon')
+        self.assertEqual(response.status_code, 400)
+
+        # JSON bodies fall back to the current time like any unparseable time
+        response = self.api.post(self.url, {'session_id': 'json-epoch', 'start_time': 1e20}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class SessionUpsertTests(TestCase):
+    """Session.objects.upsert - get or create a session, one statement on the usual path"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('upsert')
+        self.start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        self.later = datetime(2026, 1, 2, tzinfo=dt_timezone.utc)
+
+    def test_new_session_is_created(self):
+        with CaptureQueriesContext(connection) as queries:
+            session, created = Session.objects.upsert('new', self.user, self.start)
+        self.assertTrue(created)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual((session.session_id, session.user_id, session.start_time), ('new', self.user.id, self.start))
+        self.assertIsNone(session.end_time)
+        self.assertEqual(Session.objects.get().id, session.id)
+
+    def test_ended_session_is_restarted(self):
+        Session.objects.create(session_id='ended', user=self.user, start_time=self.start, end_time=self.start, duration=60)
+
+        session, created = Session.objects.upsert('ended', self.user, self.later)
+        self.assertFalse(created)
+        self.assertEqual(session.start_time, self.later)
+        self.assertIsNone(session.end_time)
+        self.assertIsNone(Session.objects.get().duration)
+
+    def test_ended_session_is_kept_without_restart_ended(self):
+        Session.objects.create(session_id='ended', user=self.user, start_time=self.start, end_time=self.start, duration=60)
+
+        with CaptureQueriesContext(connection) as queries:
+            session, created = Session.objects.upsert('ended', self.user, self.later, restart_ended=False)
+        self.assertFalse(created)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual((session.start_time, session.end_time, session.duration), (self.start, self.start, 60))
+
+    def test_missing_session_is_created_without_restart_ended(self):
+        session, created = Session.objects.upsert('missing', self.user, self.start, restart_ended=False)
+        self.assertTrue(created)
+        self.assertEqual(Session.objects.get().id, session.id)
+
+    def test_active_session_is_returned_unchanged(self):
+        Session.objects.create(session_id='active', user=self.user, start_time=self.start)
+
+        session, created = Session.objects.upsert('active', self.user, self.later)
+        self.assertFalse(created)
+        self.assertEqual(session.start_time, self.start)
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_session_of_another_user_is_not_returned(self):
+        Session.objects.create(session_id='taken', user=self.user, start_time=self.start, end_time=self.start)
+        other = User.objects.create_user('other')
+
+        self.assertEqual(Session.objects.upsert('taken', other, self.later), (None, False))
+        self.assertEqual(Session.objects.upsert('taken', other, self.later, restart_ended=False), (None, False))
+        session = Session.objects.get()
+        self.assertEqual((session.user_id, session.start_time), (self.user.id, self.start))
+
+    def test_session_start_returns_201_only_for_new_sessions(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        body = {'session_id': 'retried', 'start_time': '2026-01-01T00:00:00Z'}
+        self.assertEqual(api.post('/api/track/session/start', body, format='json').status_code, 201)
+        # Retry with the same start_time
+        self.assertEqual(api.post('/api/track/session/start', body, format='json').status_code, 200)
+
+        Session.objects.filter(session_id='retried').update(end_time=self.later, duration=86400)
+        response = api.post('/api/track/session/start', {
+            'session_id': 'retried', 'start_time': '2026-01-03T00:00:00Z',
+        }, format='json')
+        # Restarted, not created
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(Session.objects.get().end_time)
+
+    def test_session_start_accepts_non_string_session_ids(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        response = api.post('/api/track/session/start', {'session_id': 123, 'start_time': '2026-01-01T00:00:00Z'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['session_id'], '123')
+
+        response = api.post('/api/track/session/start', {'session_id': 'x' * 101, 'start_time': '2026-01-01T00:00:00Z'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['session_id'], ['Ensure this field has no more than 100 characters.'])
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """On-demand profiling of staff requests (core/profiling.py)"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        override = override_settings(PROFILING_DIR=self.directory, PROFILING_SAMPLE_RATE=0.0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.user = User.objects.create_user('regular')
+
+    def get(self, user, header='1'):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return api.get('/api/invoices/', HTTP_X_PROFILE=header)
+
+    def test_staff_request_is_profiled(self):
+        response = self.get(self.staff)
+        self.assertEqual(response.status_code, 200)
+        name = response['X-Profile-Id']
+        self.assertTrue((self.directory / f'{name}.collapsed').exists())
+        profile = json.loads((self.directory / f'{name}.queries.json').read_text())
+        self.assertEqual((profile['method'], profile['path'], profile['status']), ('GET', '/api/invoices/', 200))
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+        self.assertGreater(profile['query_count'], 0)
+
+    def test_staff_session_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:index'), HTTP_X_PROFILE='true')
+        self.assertIn('X-Profile-Id', response)
+
+    def test_non_staff_request_is_not_profiled(self):
+        response = self.get(self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_false_header_values_are_ignored(self):
+        for header in ('0', 'false', 'no', ''):
+            with self.subTest(header=header):
+                self.assertNotIn('X-Profile-Id', self.get(self.staff, header))
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+
+class ChangeFeedTests(TestCase):
+    """Cursor paging, tombstones and sparse fields of the invoice change feed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('syncer')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.invoices = [
+            Invoice.objects.create(
+                invoice_no=f'INV-SYNC-{i}', client_name='Sync Sdn Bhd', amount='10.00', date='2025-01-10',
+                status='Unpaid', created_by=self.user,
+            )
+            for i in range(3)
+        ]
+
+    def changes(self, **params):
+        response = self.api.get('/api/invoices/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_sync_is_paged_by_limit(self):
+        first = self.changes(limit=2)
+        self.assertEqual([invoice['id'] for invoice in first['changed']], [invoice.id for invoice in self.invoices[:2]])
+        self.assertTrue(first['has_more'])
+
+        second = self.changes(since=first['cursor'], limit=2)
+        self.assertEqual([invoice['id'] for invoice in second['changed']], [self.invoices[2].id])
+        self.assertEqual(second['deleted'], [])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(second['cursor'], ChangeSequence.objects.current(Invoice.CHANGE_SEQUENCE))
+
+        # Nothing changed since the last cursor
+        self.assertEqual(self.changes(since=second['cursor']), {
+            'cursor': second['cursor'], 'has_more': False, 'changed': [], 'deleted': [],
+        })
+
+    def test_changes_since_cursor_include_updates_and_deletes(self):
+        cursor = self.changes()['cursor']
+        updated, deleted = self.invoices[0], self.invoices[1]
+        updated.status = 'Paid'
+        updated.save()
+        deleted_id = deleted.id
+        deleted.delete()
+
+        page = self.changes(since=cursor)
+        self.assertEqual([(invoice['id'], invoice['status']) for invoice in page['changed']], [(updated.id, 'Paid')])
+        self.assertEqual(page['deleted'], [deleted_id])
+        # A full sync skips tombstones
+        self.assertEqual(self.changes()['deleted'], [])
+
+    def test_partial_save_is_in_the_feed(self):
+        cursor = self.changes()['cursor']
+        invoice = self.invoices[2]
+        updated_at = invoice.updated_at
+        invoice.is_done = True
+        invoice.save(update_fields=['is_done'])
+
+        page = self.changes(since=cursor)
+        self.assertEqual([(change['id'], change['is_done']) for change in page['changed']], [(invoice.id, True)])
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.change_seq, page['cursor'])
+        self.assertGreater(invoice.updated_at, updated_at)
+
+    def test_changes_always_include_the_id(self):
+        page = self.changes(fields='amount')
+        self.assertEqual(page['changed'][0], {'id': self.invoices[0].id, 'amount': '10.00'})
+
+    def test_invalid_cursor_and_limit_are_rejected(self):
+        self.assertEqual(self.api.get('/api/invoices/changes/?since=-1').status_code, 400)
+        self.assertEqual(self.api.get('/api/invoices/changes/?limit=0').status_code, 400)
+
+
+@fixed_tracking_times
+class OpenEventCacheTests(TestCase):
+    """event_end closes events started by this process with a single UPDATE"""
+
+    def setUp(self):
+        reset_tracking_state()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('opener'))
+
+    def test_numeric_session_id_hits_the_cache(self):
+        self.api.post('/api/track/session/start', {'session_id': 42, 'start_time': '2026-01-01T00:00:00Z'}, format='json')
+        self.api.post('/api/track/event/start', {
+            'session_id': 42, 'page': '/dashboard', 'start_time': '2026-01-01T00:00:05Z',
+        }, format='json')
+
+        with self.assertNumQueries(1):
+            response = self.api.post('/api/track/event/end', {
+                'session_id': 42, 'page': '/dashboard', 'end_time': '2026-01-01T00:00:10Z',
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PageEvent.objects.get().duration, 5)
+
+
+@fixed_tracking_times
+class PagePathTests(TestCase):
+    """Page paths are normalized to route templates and interned as Page rows"""
+
+    def setUp(self):
+        reset_tracking_state()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('browser'))
+        self.api.post('/api/track/session/start', {'session_id': 'paths', 'start_time': '2026-01-01T00:00:00Z'}, format='json')
+
+    def test_normalize_page_path(self):
+        for raw, normalized in [
+            ('/invoices/42/edit?x=1', '/invoices/[id]/edit'),
+            ('/invoices/550e8400-e29b-41d4-a716-446655440000#top', '/invoices/[id]'),
+            ('/invoices/new/', '/invoices/new'),
+            ('/dashboard?tab=2', '/dashboard'),
+            ('/', '/'),
+            ('?x=1', '/'),
+        ]:
+            with self.subTest(raw=raw):
+                self.assertEqual(normalize_page_path(raw), normalized)
+
+    def test_get_page_interns_normalized_paths(self):
+        page = get_page('/invoices/42/edit?x=1')
+        self.assertEqual(page.path, '/invoices/[id]/edit')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_page('/invoices/43/edit').id, page.id)
+
+        page_cache.clear()
+        self.assertIsNone(get_page('/settings', create=False))
+        self.assertIsNone(get_page('/' + 'x' * MAX_PATH_LENGTH))
+        self.assertEqual(list(Page.objects.values_list('path', flat=True)), ['/invoices/[id]/edit'])
+
+    def test_event_end_closes_the_event_of_the_normalized_path(self):
+        self.api.post('/api/track/event/start', {
+            'session_id': 'paths', 'page': '/invoices/42/edit?x=1', 'start_time': '2026-01-01T00:00:05Z',
+        }, format='json')
+        # Another worker - the open event is looked up by session and page
+        open_page_events.clear()
+        page_cache.clear()
+
+        response = self.api.post('/api/track/event/end', {
+            'session_id': 'paths', 'page': '/invoices/42/edit', 'end_time': '2026-01-01T00:00:10Z',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        event = PageEvent.objects.get()
+        self.assertEqual((event.page.path, event.duration), ('/invoices/[id]/edit', 5))
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Runs each test with the database migrated to `before`, and back to the latest migration afterwards"""
+    before = after = None
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+
+    def tearDown(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.executor.loader.graph.leaf_nodes())
+        # Partitions aren't models, flushing the database after the test leaves them behind
+        for key in sum(list_partitions(), []):
+            drop_partition(key)
+
+    def migrate(self, targets):
+        self.executor.loader.build_graph()
+        self.executor.migrate(targets)
+        return self.executor.loader.project_state(targets).apps
+
+
+class PagePathMigrationTests(MigrationTestCase):
+    """Migration 0004 interns existing page paths, and copies them back when reversed"""
+    before = [('invoices', '0003_beaconreceipt')]
+    after = [('invoices', '0004_page')]
+
+    def test_intern_pages_and_restore_page_paths(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        user = apps.get_model('auth', 'User').objects.create(username='migrated')
+        session = apps.get_model('invoices', 'Session').objects.create(
+            session_id='migrated', user_id=user.id, start_time=timezone.now(),
+        )
+        for path in ['/invoices/42/edit?x=1', '/invoices/7/edit', '/dashboard/']:
+            apps.get_model('invoices', 'PageEvent').objects.create(
+                session_id=session.id, user_id=user.id, page=path, start_time=timezone.now(),
+            )
+
+        apps = self.migrate(self.after)
+        PageEvent = apps.get_model('invoices', 'PageEvent')
+        self.assertEqual(
+            sorted(apps.get_model('invoices', 'Page').objects.values_list('path', flat=True)),
+            ['/dashboard', '/invoices/[id]/edit'],
+        )
+        self.assertEqual(PageEvent.objects.filter(page__path='/invoices/[id]/edit').count(), 2)
+
+        apps = self.migrate(self.before)
+        self.assertEqual(
+            sorted(apps.get_model('invoices', 'PageEvent').objects.values_list('page', flat=True)),
+            ['/dashboard', '/invoices/[id]/edit', '/invoices/[id]/edit'],
+        )
+
+
+class PageEventPartitionMigrationTests(MigrationTestCase):
+    """Migration 0006 moves page events to monthly partitions, and merges them back when reversed"""
+    before = [('invoices', '0005_invoice_change_feed')]
+    after = [('invoices', '0006_partition_page_events')]
+
+    def test_partition_and_merge_page_events(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        user = apps.get_model('auth', 'User').objects.create(username='migrated')
+        session = apps.get_model('invoices', 'Session').objects.create(
+            session_id='migrated', user_id=user.id, start_time=datetime(2026, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        page = apps.get_model('invoices', 'Page').objects.create(path='/dashboard')
+        for month in (1, 2, 2):
+            apps.get_model('invoices', 'PageEvent').objects.create(
+                session_id=session.id, user_id=user.id, page_id=page.id,
+                start_time=datetime(2026, month, 15, tzinfo=dt_timezone.utc),
+            )
+
+        self.migrate(self.after)
+        self.assertEqual(list_partitions(), (['202601', '202602'], []))
+        self.assertEqual(partition_model('202602').objects.count(), 2)
+        self.assertEqual(PageEvent.objects.count(), 3)
+        # New events continue from the first id of their month
+        event = PageEvent.objects.create(
+            session_id=session.id, user_id=user.id, page_id=page.id, start_time=datetime(2026, 2, 20, tzinfo=dt_timezone.utc),
+        )
+        self.assertEqual(event.id, 202602 * 10 ** 10 + 1)
+
+        apps = self.migrate(self.before)
+        self.assertEqual(apps.get_model('invoices', 'PageEvent').objects.count(), 4)
+        self.assertEqual(list_partitions(), ([], []))
@@ -0,0 +1,128 @@
+"""
+Rate limiting and load shedding for the tracking endpoints
+
+- TokenBucketThrottle: in-memory token bucket per (scope, user). DRF answers
+  rejected requests with 429 and a Retry-After header before the view runs.
+- shed_load: counts tracking requests currently writing to the database and,
+  once TRACKING_MAX_PENDING_WRITES is reached, drops low-priority (page event start)
+  requests instead of queueing them behind the SQLite writer.
+"""
+import functools
+import threading
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import SimpleRateThrottle
+
+from .lru import LRUCache
+
+# (scope, ident) -> (tokens, last refill time)
+buckets = LRUCache(getattr(settings, 'TRACKING_THROTTLE_CACHE_SIZE', 10000))
+_buckets_lock = threading.Lock()
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle using the rate format of DRF's DEFAULT_THROTTLE_RATES
+    A rate of 'N/period' allows bursts of N requests, refilled at N per period.
+    Users are identified by the authenticated user, the token sent in the body
+    (sendBeacon), or the client IP as a last resort. DRF authenticates before
+    throttling, so views using it authenticate with JWTStatelessUserAuthentication
+    to reject requests before any query.
+    """
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = self.get_token_ident(request) or f'ip:{self.get_ident(request)}'
+        return (self.scope, ident)
+    
+    def get_token_ident(self, request):
+        """User id from a token sent in the request body, without a database query"""
+        from rest_framework_simplejwt.tokens import UntypedToken
+        from rest_framework_simplejwt.exceptions import TokenError
+        
+        token = request.data.get('token') if hasattr(request.data, 'get') else None
+        if not token:
+            return None
+        try:
+            return f"user:{UntypedToken(token)['user_id']}"
+        except (TokenError, KeyError):
+            return None
+    
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        
+        self.key = self.get_cache_key(request, view)
+        self.refill_rate = self.num_requests / self.duration  # Tokens per second
+        self.now = self.timer()
+        
+        with _buckets_lock:
+            tokens, last = buckets.get(self.key, (self.num_requests, self.now))
+            tokens = min(self.num_requests, tokens + (self.now - last) * self.refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            buckets.set(self.key, (tokens, self.now))
+        
+        self.tokens = tokens
+        return allowed
+    
+    def wait(self):
+        """Seconds until the bucket holds a token again"""
+        return max(0, (1 - self.tokens) / self.refill_rate)
+
+
+class TrackingStartThrottle(TokenBucketThrottle):
+    """Throttle for session/event start requests"""
+    scope = 'tracking_start'
+
+
+class TrackingEndThrottle(TokenBucketThrottle):
+    """Throttle for session/event end requests (beacons)"""
+    scope = 'tracking_end'
+
+
+class PendingWrites:
+    """Counter of tracking requests currently doing database work"""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        with self._lock:
+            self.count += 1
+    
+    def release(self):
+        with self._lock:
+            self.count -= 1
+
+
+pending_writes = PendingWrites()
+
+
+def shed_load(droppable):
+    """
+    Decorator for tracking views - counts them as pending database writes
+    
+    When the number of pending writes reaches TRACKING_MAX_PENDING_WRITES, droppable
+    (info-level) requests are answered with 202 and not processed. Only page event
+    starts are droppable: session requests and page exits are never dropped, a dropped
+    exit would leave its event open until session_end and record a wrong duration.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            max_pending = getattr(settings, 'TRACKING_MAX_PENDING_WRITES', None)
+            if droppable and max_pending is not None and pending_writes.count >= max_pending:
+                return Response({'dropped': True}, status=status.HTTP_202_ACCEPTED)
+            
+            pending_writes.acquire()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                pending_writes.release()
+        return wrapper
+    return decorator
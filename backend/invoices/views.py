@@ -1,27 +1,215 @@
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    action, api_view, authentication_classes, parser_classes, permission_classes, throttle_classes,
+)
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta
 from .models import Invoice, Session, PageEvent
 from .serializers import InvoiceSerializer, SessionSerializer, PageEventSerializer
+from .dedup import deduplicate_beacon
+from .open_events import close_open_event, remember_open_event
+from .pages import MAX_PATH_LENGTH, get_page
+from .parsers import parse_timestamp, tracking_parsers
+from .partitions import PartitionUnavailable
+from .reports import GRANULARITIES, MAX_PERIODS, build_report, period_starts
+from .sync import PAGE_SIZE, EventStreamRenderer, changes_since, parse_cursor, stream_changes
+from .throttling import TrackingEndThrottle, TrackingStartThrottle, shed_load
 
 class InvoiceViewSet(viewsets.ModelViewSet):
+    """
+    Invoice CRUD endpoints
+    
+    Supports sparse fieldsets: ?fields=id,amount,status serializes only those fields,
+    and GET requests load only the matching columns (skipping the created_by join
+    unless created_by_username is requested). Writes validate and save every field
+    and only trim their response.
+    
+    Clients keeping a local copy sync it with the change feed (changes/ and
+    changes/stream/) instead of refetching the list, see sync.py.
+    """
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    # Model columns needed to serialize each field
+    FIELD_COLUMNS = {
+        'created_by': ['created_by'],
+        'created_by_username': ['created_by__username'],
+    }
+    
+    # Actions reading the change feed, which is ordered by change_seq
+    SYNC_ACTIONS = {'changes', 'changes_stream'}
+
+    def get_requested_fields(self):
+        """Field names from ?fields=, or None to serialize every field"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            fields_param = self.request.query_params.get('fields') if self.request else None
+            if fields_param:
+                requested = [name.strip() for name in fields_param.split(',') if name.strip()]
+                unknown = set(requested) - set(InvoiceSerializer.Meta.fields)
+                if unknown:
+                    raise ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+                if self.action in self.SYNC_ACTIONS and 'id' not in requested:
+                    # Synced clients merge changes by id
+                    requested.insert(0, 'id')
+                self._requested_fields = requested
+        return self._requested_fields
+
     def get_queryset(self):
-        queryset = Invoice.objects.all().select_related('created_by')
-        return queryset
+        fields = self.get_requested_fields()
+        if fields is None or self.request.method not in permissions.SAFE_METHODS:
+            return Invoice.objects.all().select_related('created_by')
+        
+        columns = {'id', 'change_seq'} if self.action in self.SYNC_ACTIONS else {'id'}
+        for name in fields:
+            columns.update(self.FIELD_COLUMNS.get(name, [name]))
+        queryset = Invoice.objects.all()
+        if 'created_by_username' in fields:
+            queryset = queryset.select_related('created_by')
+        return queryset.only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        # Writes are validated and saved with every field, only their response is trimmed
+        if fields is not None and self.request.method in permissions.SAFE_METHODS:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def trim_response(self, response):
+        """Keep only the ?fields= of a write response"""
+        fields = self.get_requested_fields()
+        if fields is not None:
+            response.data = {name: value for name, value in response.data.items() if name in fields}
+        return response
+
+    def create(self, request, *args, **kwargs):
+        return self.trim_response(super().create(request, *args, **kwargs))
+
+    def update(self, request, *args, **kwargs):
+        return self.trim_response(super().update(request, *args, **kwargs))
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+    def get_change_page(self, cursor, limit=PAGE_SIZE):
+        """Payload of one page of the change feed after cursor"""
+        invoices, deleted, next_cursor, has_more = changes_since(self.get_queryset(), cursor, limit)
+        return {
+            'cursor': next_cursor,
+            'has_more': has_more,
+            'changed': self.get_serializer(invoices, many=True).data,
+            'deleted': deleted,
+        }
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """GET /api/invoices/changes/?since=<cursor>&limit=500
+        
+        Invoices created or updated and ids of invoices deleted after the cursor.
+        Without `since` (or since=0) every invoice is returned. Keep the returned
+        cursor for the next request and repeat while has_more is true.
+        """
+        cursor = parse_cursor(request.query_params.get('since'))
+        if cursor is None:
+            return Response({'error': 'since must be a cursor returned by this endpoint'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            limit = int(request.query_params.get('limit', PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= PAGE_SIZE:
+            return Response({'error': f'limit must be between 1 and {PAGE_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(self.get_change_page(cursor, limit))
+
+    @action(detail=False, methods=['get'], url_path='changes/stream', renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def changes_stream(self, request):
+        """GET /api/invoices/changes/stream/?since=<cursor>
+        
+        Server-Sent Events stream of the change feed: each "changes" event carries the
+        same payload as changes/ and the new cursor as its id. Reconnecting clients
+        resume from the Last-Event-ID header.
+        """
+        cursor = parse_cursor(request.headers.get('Last-Event-ID') or request.query_params.get('since'))
+        if cursor is None:
+            raise ValidationError({'since': 'since must be a cursor returned by the change feed'})
+        
+        response = StreamingHttpResponse(stream_changes(self.get_change_page, cursor), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Don't let a proxy buffer the stream
+        return response
+
+    @action(detail=False, methods=['get'])
+    def report(self, request):
+        """GET /api/invoices/report/?granularity=month&start=YYYY-MM-DD&end=YYYY-MM-DD
+        
+        Invoice totals per period, split by status and by creator.
+        Defaults to monthly periods from January 1st of the current year until today.
+        """
+        from django.utils.dateparse import parse_date
+        from django.contrib.auth.models import User
+        
+        granularity = request.query_params.get('granularity', 'month')
+        if granularity not in GRANULARITIES:
+            return Response(
+                {'error': f"granularity must be one of: {', '.join(GRANULARITIES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        today = timezone.localdate()
+        dates = {}
+        for name, default in (('start', today.replace(month=1, day=1)), ('end', today)):
+            value = request.query_params.get(name)
+            try:
+                # parse_date returns None for malformed input, raises ValueError for impossible dates
+                dates[name] = parse_date(value) if value else default
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                return Response({'error': 'start and end must be valid dates (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        start, end = dates['start'], dates['end']
+        
+        if start > end:
+            return Response({'error': 'start must be before end'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(period_starts(start, end, granularity)) > MAX_PERIODS:
+            return Response(
+                {'error': f'Report is limited to {MAX_PERIODS} periods, use a coarser granularity'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        series = build_report(start, end, granularity)
+        creator_ids = {int(creator_id) for period in series for creator_id in period['by_creator']}
+        creators = {
+            str(user_id): username
+            for user_id, username in User.objects.filter(id__in=creator_ids).values_list('id', 'username')
+        }
+        
+        return Response({
+            'granularity': granularity,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'creators': creators,
+            'series': series,
+        })
+
 
 # ========== TRACKING VIEWS ==========
+# Authenticated from the JWT claims without loading the user (a TokenUser, whose id is
+# the user_id claim), so throttled requests are rejected without any query.
 
 @api_view(['POST'])
+@parser_classes(tracking_parsers('session_id', 'start_time', 'event_id'))
+@authentication_classes([JWTStatelessUserAuthentication])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([TrackingStartThrottle])
+@shed_load(droppable=False)
+@deduplicate_beacon
 def session_start(request):
     """POST /api/track/session/start - Create new session"""
     import logging
@@ -39,41 +227,17 @@ def session_start(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Check if session already exists
-    existing_session = Session.objects.filter(session_id=session_id, user=request.user).first()
-    if existing_session:
-        # Parse start_time string to datetime FIRST
-        from django.utils.dateparse import parse_datetime
-        start_time_dt = parse_datetime(start_time)
-        
-        if not start_time_dt:
-            start_time_dt = timezone.now()
-        elif timezone.is_naive(start_time_dt):
-            start_time_dt = timezone.make_aware(start_time_dt)
-        
-        # Check session status
-        existing_session.refresh_from_db()  # Refresh to get latest end_time
-        
-        if existing_session.end_time is not None:
-            # Previous session was ended - user is starting a NEW session
-            # Reset the ended session to start fresh
-            logger.info(f"Resetting ended session for new session - id: {existing_session.id}")
-            existing_session.start_time = start_time_dt  # New start time
-            existing_session.end_time = None  # Reset end_time
-            existing_session.duration = None  # Reset duration
-            existing_session.save()
-            logger.info(f"Session reset for new session - id: {existing_session.id}, start_time: {existing_session.start_time}, user: {existing_session.user.id}")
-            serializer = SessionSerializer(existing_session)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            # Session still active - keep original start_time, just return existing session
-            logger.info(f"Session still active - returning existing session - id: {existing_session.id}")
-            serializer = SessionSerializer(existing_session)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+    # Compact beacons and JSON bodies may send a number
+    session_id = str(session_id)
+    max_length = Session._meta.get_field('session_id').max_length
+    if len(session_id) > max_length:
+        return Response(
+            {'session_id': [f'Ensure this field has no more than {max_length} characters.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     # Parse start_time string to datetime
-    from django.utils.dateparse import parse_datetime
-    start_time_dt = parse_datetime(start_time)
+    start_time_dt = parse_timestamp(start_time)
     
     if not start_time_dt:
         # If parse fails, use timezone.now()
@@ -81,26 +245,30 @@ def session_start(request):
     elif timezone.is_naive(start_time_dt):
         start_time_dt = timezone.make_aware(start_time_dt)
     
-    serializer = SessionSerializer(data={
-        'session_id': session_id,
-        'user': request.user.id,
-        'start_time': start_time_dt,
-    })
+    # Create the session, restart it if it was ended, or return it if still active - one query for new sessions
+    session, created = Session.objects.upsert(session_id, request.user, start_time_dt)
     
-    if serializer.is_valid():
-        session = serializer.save(user=request.user)
-        logger.info(f"Session created - id: {session.id}, session_id: {session.session_id}, start_time: {session.start_time}, user: {session.user.id}")
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    if session is None:
+        logger.error(f"Session start rejected - session_id {session_id} belongs to another user, user: {request.user.id}")
+        return Response({'session_id': ['session with this session id already exists.']}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Log errors for debugging
-    logger.error(f"Session start validation errors: {serializer.errors}")
-    logger.error(f"Request data: {request.data}")
+    serializer = SessionSerializer(session)
+    if created:
+        logger.info(f"Session started - id: {session.id}, session_id: {session.session_id}, start_time: {session.start_time}, user: {request.user.id}")
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
     
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    # Existing session - restarted at start_time if it was ended, else unchanged
+    logger.info(f"Existing session returned - id: {session.id}, start_time: {session.start_time}")
+    return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
+@parser_classes(tracking_parsers('session_id', 'page', 'start_time', 'event_id'))
+@authentication_classes([JWTStatelessUserAuthentication])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([TrackingStartThrottle])
+@shed_load(droppable=True)
+@deduplicate_beacon
 def event_start(request):
     """POST /api/track/event/start - Create new page event"""
     session_id = request.data.get('session_id')
@@ -119,32 +287,16 @@ def event_start(request):
         )
     
     try:
-        # Try to get existing session, if not found, create it
-        session = Session.objects.filter(session_id=session_id, user=request.user).first()
-        
-        if not session:
-            # Session doesn't exist yet - create it automatically
-            logger.warn(f"Session not found for event_start, creating new session - session_id: {session_id}, user: {request.user.id}")
-            
-            # Parse start_time for session creation
-            from django.utils.dateparse import parse_datetime
-            session_start_time = parse_datetime(start_time_str)
-            if not session_start_time:
-                session_start_time = timezone.now()
-            elif timezone.is_naive(session_start_time):
-                session_start_time = timezone.make_aware(session_start_time)
-            
-            # Create new session
-            session = Session.objects.create(
-                session_id=session_id,
-                user=request.user,
-                start_time=session_start_time
+        # Resolve the page path to its Page row (cached after the first lookup)
+        page_obj = get_page(str(page))
+        if page_obj is None:
+            return Response(
+                {'page': [f'Ensure this field has no more than {MAX_PATH_LENGTH} characters.']},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            logger.info(f"Auto-created session - id: {session.id}, session_id: {session.session_id}, start_time: {session.start_time}")
         
         # Parse start_time string to datetime
-        from django.utils.dateparse import parse_datetime
-        start_time = parse_datetime(start_time_str)
+        start_time = parse_timestamp(start_time_str)
         
         if not start_time:
             # If parse fails, use timezone.now()
@@ -153,23 +305,42 @@ def event_start(request):
         elif timezone.is_naive(start_time):
             start_time = timezone.make_aware(start_time)
         
-        serializer = PageEventSerializer(data={
-            'session': session.id,
-            'user': request.user.id,
-            'page': page,
-            'start_time': start_time,
-        })
+        # start_time picks the monthly partition the event is written to (and creates it if
+        # needed), so a skewed or replayed client clock must not reach far-off months
+        max_skew = getattr(settings, 'TRACKING_MAX_CLOCK_SKEW', None)
+        if max_skew is not None and abs((start_time - timezone.now()).total_seconds()) > max_skew:
+            logger.error(f"Event start rejected - start_time {start_time} is more than {max_skew}s from the server time")
+            return Response(
+                {'start_time': [f'Ensure this value is within {max_skew} seconds of the server time.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if serializer.is_valid():
-            page_event = serializer.save(user=request.user, session=session)
-            # Refresh to ensure data is saved
-            page_event.refresh_from_db()
-            logger.info(f"Page event created - id: {page_event.id}, page: {page_event.page}, start_time: {page_event.start_time}, session_id: {session.session_id}, user: {request.user.id}")
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Get the session, creating it automatically if it doesn't exist yet - one query for existing sessions
+        session, _ = Session.objects.upsert(session_id, request.user, start_time, restart_ended=False)
         
-        logger.error(f"Page event validation errors: {serializer.errors}")
-        logger.error(f"Request data: {request.data}")
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if session is None:
+            logger.error(f"Event start rejected - session_id {session_id} belongs to another user, user: {request.user.id}")
+            return Response({'error': 'Session belongs to another user'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            page_event = PageEvent.objects.create(
+                session=session,
+                user_id=int(request.user.id),
+                page=page_obj,
+                start_time=start_time
+            )
+        except PartitionUnavailable as e:
+            # The month was detached (archived) - late events for it are not accepted
+            logger.error(f"Event start rejected - {e}")
+            return Response(
+                {'start_time': ['Events of this month are no longer accepted.']},
+                status=status.HTTP_409_CONFLICT
+            )
+        remember_open_event(page_event, session.session_id)
+        logger.info(f"Page event created - id: {page_event.id}, page: {page_obj.path}, start_time: {page_event.start_time}, session_id: {session.session_id}, user: {request.user.id}")
+        
+        serializer = PageEventSerializer(page_event)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
         
     except Exception as e:
         logger.error(f"Error in event_start: {str(e)}", exc_info=True)
@@ -177,43 +348,47 @@ def event_start(request):
 
 
 @api_view(['POST'])
+@parser_classes(tracking_parsers('session_id', 'page', 'end_time', 'duration', 'event_id', 'token'))
+@authentication_classes([JWTStatelessUserAuthentication])
+@throttle_classes([TrackingEndThrottle])
+@shed_load(droppable=False)
+@deduplicate_beacon
 def event_end(request):
     """POST /api/track/event/end - Update page event with end time
     
     Supports token in body (for sendBeacon) or Authorization header (for normal requests)
     Note: permission_classes removed to allow token in body authentication
+    
+    Events started by this process are closed with a single UPDATE by primary key
+    (see open_events.py); otherwise falls back to looking up the latest open event.
     """
+    import logging
+    logger = logging.getLogger(__name__)
+    
     # Handle token from body (for sendBeacon) or header (for normal requests)
     token_from_body = request.data.get('token')
     if token_from_body:
-        # Token in body - authenticate manually
+        # Token in body - validate it, the user is only fetched if the fast path misses
         from rest_framework_simplejwt.tokens import UntypedToken
         from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
         
         try:
             validated_token = UntypedToken(token_from_body)
             user_id = validated_token['user_id']
-            user = User.objects.get(id=user_id)
-        except (InvalidToken, TokenError, User.DoesNotExist) as e:
-            import logging
-            logger = logging.getLogger(__name__)
+        except (InvalidToken, TokenError) as e:
             logger.error(f"Invalid token in body: {str(e)}")
             return Response({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
     else:
         # Use authenticated user from header (requires IsAuthenticated)
         if not request.user or not request.user.is_authenticated:
             return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
-        user = request.user
+        user_id = request.user.id
     
     session_id = request.data.get('session_id')
     page = request.data.get('page')
     end_time_str = request.data.get('end_time')
     duration = request.data.get('duration')
     
-    import logging
-    logger = logging.getLogger(__name__)
     logger.info(f"Event end request - session_id: {session_id}, page: {page}, end_time: {end_time_str}, duration: {duration}")
     
     if not session_id or not page or not end_time_str:
@@ -224,11 +399,8 @@ def event_end(request):
         )
     
     try:
-        session = Session.objects.get(session_id=session_id, user=user)
-        
         # Parse end_time string to datetime
-        from django.utils.dateparse import parse_datetime
-        end_time = parse_datetime(end_time_str)
+        end_time = parse_timestamp(end_time_str)
         
         if not end_time:
             # If parse fails, use timezone.now()
@@ -237,10 +409,35 @@ def event_end(request):
         elif timezone.is_naive(end_time):
             end_time = timezone.make_aware(end_time)
         
+        if duration is not None:
+            duration = int(duration)
+        
+        # Resolve the page path to its Page row (cached after the first lookup)
+        page_obj = get_page(str(page), create=False)
+        if page_obj is None:
+            logger.warn(f"No active page event found for page: {page}, session: {session_id}")
+            return Response({'error': 'Page event not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Fast path - close the event started by this process by primary key
+        page_event = close_open_event(user_id, session_id, page_obj, end_time, duration)
+        if page_event:
+            logger.info(f"Page event ended - id: {page_event.id}, page: {page_obj.path}, end_time: {page_event.end_time}, duration: {page_event.duration}s, session_id: {session_id}, user: {user_id}")
+            serializer = PageEventSerializer(page_event)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        
+        if token_from_body:
+            from django.contrib.auth import get_user_model
+            User = get_user_model()
+            if not User.objects.filter(id=user_id).exists():
+                logger.error(f"Invalid token in body: user {user_id} does not exist")
+                return Response({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        session = Session.objects.get(session_id=session_id, user_id=user_id)
+        
         # Find the most recent page event for this page that hasn't ended
         page_event = PageEvent.objects.filter(
             session=session,
-            page=page,
+            page=page_obj,
             end_time__isnull=True
         ).order_by('-start_time').first()
         
@@ -248,14 +445,15 @@ def event_end(request):
             logger.warn(f"No active page event found for page: {page}, session: {session_id}")
             return Response({'error': 'Page event not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        logger.info(f"Found page event - id: {page_event.id}, page: {page_event.page}, start_time: {page_event.start_time}")
+        page_event.page = page_obj  # Reuse the cached Page instead of fetching it again
+        logger.info(f"Found page event - id: {page_event.id}, page: {page_obj.path}, start_time: {page_event.start_time}")
         
         # Update page event
         page_event.end_time = end_time
         
         # Calculate duration if not provided or if provided duration seems wrong
         if duration is not None:
-            page_event.duration = int(duration)
+            page_event.duration = duration
         elif page_event.start_time:
             # Calculate from start_time and end_time
             page_event.duration = int((page_event.end_time - page_event.start_time).total_seconds())
@@ -263,16 +461,14 @@ def event_end(request):
             page_event.duration = 0
         
         # Save to database
-        page_event.save()
-        # Refresh from database to ensure it's saved
-        page_event.refresh_from_db()
-        logger.info(f"Page event ended - id: {page_event.id}, page: {page_event.page}, end_time: {page_event.end_time}, duration: {page_event.duration}s, session_id: {session.session_id}, user: {user.id}")
+        page_event.save(update_fields=['end_time', 'duration'])
+        logger.info(f"Page event ended - id: {page_event.id}, page: {page_obj.path}, end_time: {page_event.end_time}, duration: {page_event.duration}s, session_id: {session.session_id}, user: {user_id}")
         
         serializer = PageEventSerializer(page_event)
         return Response(serializer.data, status=status.HTTP_200_OK)
         
     except Session.DoesNotExist:
-        logger.error(f"Session not found - session_id: {session_id}, user: {user.id}")
+        logger.error(f"Session not found - session_id: {session_id}, user: {user_id}")
         return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         logger.error(f"Error in event_end: {str(e)}", exc_info=True)
@@ -280,6 +476,11 @@ def event_end(request):
 
 
 @api_view(['POST'])
+@parser_classes(tracking_parsers('session_id', 'end_time', 'event_id', 'token'))
+@authentication_classes([JWTStatelessUserAuthentication])
+@throttle_classes([TrackingEndThrottle])
+@shed_load(droppable=False)
+@deduplicate_beacon
 def session_end(request):
     """POST /api/track/session/end - Explicitly end session (hybrid approach)
     
@@ -321,7 +522,7 @@ def session_end(request):
         )
     
     try:
-        session = Session.objects.get(session_id=session_id, user=user)
+        session = Session.objects.get(session_id=session_id, user_id=user.pk)
         
         # If session already ended, just return success
         if session.end_time is not None:
@@ -330,8 +531,7 @@ def session_end(request):
             return Response(serializer.data, status=status.HTTP_200_OK)
         
         # Parse end_time string to datetime
-        from django.utils.dateparse import parse_datetime
-        end_time_dt = parse_datetime(end_time)
+        end_time_dt = parse_timestamp(end_time)
         
         if not end_time_dt:
             end_time_dt = timezone.now()
@@ -346,34 +546,30 @@ def session_end(request):
             duration_seconds = int((end_time_dt - session.start_time).total_seconds())
         
         # IMPORTANT: End all active page events for this session
-        active_page_events = PageEvent.objects.filter(
+        active_page_events = list(PageEvent.objects.filter(
             session=session,
             end_time__isnull=True
-        )
+        ).only('id', 'page_id', 'start_time'))
         
-        active_count = active_page_events.count()
-        
-        # End all active page events with session end_time
+        # End all active page events with session end_time - one UPDATE for all of them
         for page_event in active_page_events:
             page_event.end_time = end_time_dt
             if page_event.start_time:
                 page_event.duration = int((page_event.end_time - page_event.start_time).total_seconds())
             else:
                 page_event.duration = 0
-            page_event.save()
-            page_event.refresh_from_db()
-            logger.info(f"Ended page event - id: {page_event.id}, page: {page_event.page}, end_time: {page_event.end_time}, duration: {page_event.duration}s")
+            logger.info(f"Ended page event - id: {page_event.id}, page: {page_event.page_id}, end_time: {page_event.end_time}, duration: {page_event.duration}s")
+        PageEvent.objects.bulk_update(active_page_events, ['end_time', 'duration'])
         
-        logger.info(f"Ended {active_count} active page event(s)")
+        logger.info(f"Ended {len(active_page_events)} active page event(s)")
         
         # Update session with end_time and duration
         Session.objects.filter(id=session.id).update(
             end_time=end_time_dt,
             duration=duration_seconds
         )
-        
-        # Refresh session object from database
-        session.refresh_from_db()
+        session.end_time = end_time_dt
+        session.duration = duration_seconds
         
         logger.info(f"Session ended explicitly - end_time: {session.end_time}, duration: {session.duration}s")
         
@@ -0,0 +1,51 @@
+// Keeps a local copy of the invoices in localStorage and syncs it with the
+// change feed (GET /invoices/changes/?since=<cursor>), so a warm cache only
+// downloads what changed since the last visit
+const STORAGE_KEY = 'invoice_sync'
+
+const loadCache = () => {
+  try {
+    const cached = JSON.parse(localStorage.getItem(STORAGE_KEY))
+    if (cached && Number.isInteger(cached.cursor) && Array.isArray(cached.invoices)) {
+      return cached
+    }
+  } catch (e) {
+    // Corrupted cache - start over with a full sync
+  }
+  return { cursor: 0, invoices: [] }
+}
+
+const clearCache = () => {
+  localStorage.removeItem(STORAGE_KEY)
+}
+
+export const useInvoiceSync = () => {
+  const api = useApi()
+
+  const sync = async () => {
+    const cache = loadCache()
+    const byId = new Map(cache.invoices.map(invoice => [invoice.id, invoice]))
+    let cursor = cache.cursor
+    let hasMore = true
+
+    while (hasMore) {
+      const page = await api('/invoices/changes/', { params: { since: cursor } })
+      page.changed.forEach(invoice => byId.set(invoice.id, invoice))
+      page.deleted.forEach(id => byId.delete(id))
+      cursor = page.cursor
+      hasMore = page.has_more
+    }
+
+    // Same order as the invoice list endpoint
+    const invoices = [...byId.values()].sort((a, b) => a.id - b.id)
+    try {
+      localStorage.setItem(STORAGE_KEY, JSON.stringify({ cursor, invoices }))
+    } catch (e) {
+      // Storage full - the next visit does a full sync
+      clearCache()
+    }
+    return invoices
+  }
+
+  return { sync }
+}
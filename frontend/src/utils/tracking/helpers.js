@@ -3,6 +3,26 @@
  * Utility functions used by other tracking modules
  */
 
+/**
+ * Generate a UUID v4
+ */
+function generateUuid() {
+  return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
+    const r = Math.random() * 16 | 0
+    const v = c === 'x' ? r : (r & 0x3 | 0x8)
+    return v.toString(16)
+  })
+}
+
+/**
+ * Generate a unique event ID for a tracking request
+ * The backend drops requests whose event ID it has already processed,
+ * so retries and double-fired beacons must reuse the same ID
+ */
+export function generateEventId() {
+  return generateUuid()
+}
+
 /**
  * Generate a unique session ID (UUID)
  * Stores it in localStorage so it persists across page reloads
@@ -12,12 +32,7 @@ export function getOrCreateSessionId() {
     let sessionId = localStorage.getItem('session_id')
     
     if (!sessionId) {
-      // Generate UUID v4
-      sessionId = 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
-        const r = Math.random() * 16 | 0
-        const v = c === 'x' ? r : (r & 0x3 | 0x8)
-        return v.toString(16)
-      })
+      sessionId = generateUuid()
       localStorage.setItem('session_id', sessionId)
     }
     
@@ -3,7 +3,7 @@
  * Handles page navigation tracking
  */
 
-import { getOrCreateSessionId, getUserId, trackingRequest } from './helpers.js'
+import { generateEventId, getOrCreateSessionId, getUserId, trackingRequest } from './helpers.js'
 
 /**
  * Get current active page from sessionStorage
@@ -21,6 +21,15 @@ function setCurrentPage(page) {
   sessionStorage.setItem('current_page', page)
 }
 
+/**
+ * Get the event ID for ending a page event
+ * Derived from the start event ID so every attempt to end the same visit shares it
+ */
+function getPageEndEventId(page) {
+  const eventId = sessionStorage.getItem(`page_event_id_${page}`)
+  return eventId ? `${eventId}-end` : undefined
+}
+
 /**
  * End page event synchronously (for browser close events)
  * Uses sendBeacon or synchronous XHR for reliable delivery
@@ -62,15 +71,19 @@ export function endPageEventSync(page) {
     page: page,
     end_time: endTime,
     duration: duration,
+    event_id: getPageEndEventId(page),
     token: token
   })
   
-  // Use sendBeacon
+  // Use sendBeacon with the compact positional format:
+  // [session_id, page, end_time (epoch ms), duration, event_id, token]
   if (navigator.sendBeacon) {
-    const blob = new Blob([data], { type: 'application/json' })
+    const beacon = JSON.stringify([sessionId, page, endTimeObj.getTime(), duration, getPageEndEventId(page) ?? null, token])
+    const blob = new Blob([beacon], { type: 'application/x-beacon' })
     const success = navigator.sendBeacon(url, blob)
     if (success) {
       sessionStorage.removeItem(`page_start_${page}`)
+      sessionStorage.removeItem(`page_event_id_${page}`)
       return true
     }
   }
@@ -84,6 +97,7 @@ export function endPageEventSync(page) {
     
     if (xhr.status >= 200 && xhr.status < 300) {
       sessionStorage.removeItem(`page_start_${page}`)
+      sessionStorage.removeItem(`page_event_id_${page}`)
       return true
     }
   } catch (e) {
@@ -125,10 +139,12 @@ export async function endPageEvent(page) {
     user_id: userId,
     page: page,
     end_time: endTime,
-    duration: duration
+    duration: duration,
+    event_id: getPageEndEventId(page)
   })
   
   sessionStorage.removeItem(`page_start_${page}`)
+  sessionStorage.removeItem(`page_event_id_${page}`)
 }
 
 /**
@@ -154,7 +170,9 @@ export async function startPageEvent(page) {
   }
   
   const startTime = new Date().toISOString()
+  const eventId = generateEventId()
   sessionStorage.setItem(`page_start_${page}`, startTime)
+  sessionStorage.setItem(`page_event_id_${page}`, eventId)
   setCurrentPage(page)
   
   try {
@@ -162,7 +180,8 @@ export async function startPageEvent(page) {
       session_id: sessionId,
       user_id: userId,
       page: page,
-      start_time: startTime
+      start_time: startTime,
+      event_id: eventId
     })
     
   } catch (error) {
@@ -3,7 +3,16 @@
  * Handles session start and end
  */
 
-import { getOrCreateSessionId, getUserId, trackingRequest } from './helpers.js'
+import { generateEventId, getOrCreateSessionId, getUserId, trackingRequest } from './helpers.js'
+
+/**
+ * Get the event ID for ending the current session
+ * Derived from the start event ID so every attempt to end the session shares it
+ */
+function getSessionEndEventId() {
+  const eventId = sessionStorage.getItem('session_event_id')
+  return eventId ? `${eventId}-end` : undefined
+}
 
 /**
  * End session synchronously (for browser close events)
@@ -39,11 +48,15 @@ export function endSessionSync() {
     session_id: sessionId,
     user_id: userId,
     end_time: endTime,
+    event_id: getSessionEndEventId(),
     token: token
   })
   
+  // Use sendBeacon with the compact positional format:
+  // [session_id, end_time (epoch ms), event_id, token]
   if (navigator.sendBeacon) {
-    const blob = new Blob([data], { type: 'application/json' })
+    const beacon = JSON.stringify([sessionId, Date.parse(endTime), getSessionEndEventId() ?? null, token])
+    const blob = new Blob([beacon], { type: 'application/x-beacon' })
     const success = navigator.sendBeacon(url, blob)
     
     if (success) {
@@ -105,7 +118,8 @@ export async function endSession() {
     const data = {
       session_id: sessionId,
       user_id: userId,
-      end_time: endTime
+      end_time: endTime,
+      event_id: getSessionEndEventId()
     }
     
     const response = await fetch(url, {
@@ -155,12 +169,15 @@ export async function startSession() {
   }
   
   const startTime = new Date().toISOString()
+  const eventId = generateEventId()
+  sessionStorage.setItem('session_event_id', eventId)
   
   try {
     const response = await trackingRequest('session/start', {
       session_id: sessionId,
       user_id: userId,
-      start_time: startTime
+      start_time: startTime,
+      event_id: eventId
     })
     
     if (response) {
@@ -49,6 +49,8 @@ export const useAuthStore = defineStore('auth', {
       if (process.client) {
         localStorage.removeItem('token')
         localStorage.removeItem('refreshToken')
+        // Clear the synced invoice cache (see composables/useInvoiceSync.js)
+        localStorage.removeItem('invoice_sync')
         // Clear tracking session data
         localStorage.removeItem('session_id')
         // Clear tracking flags